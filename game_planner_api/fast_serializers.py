@@ -0,0 +1,167 @@
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+
+from .models import Player, Game
+from .serializers import PlayerSerializer, GameSerializer, NotificationSerializer, FriendshipSerializer, GameParticipationRequestSerializer
+
+def identity(value):
+    return value
+
+class FastField:
+    """
+    One output key of a FastSerializer.
+
+    lookup:   the .values() key the value is read from.
+    relation: a nullable foreign key; when it is null the key is left out,
+              as DRF does for read-only fields whose source can't be reached.
+    convert:  applied to non-null values, defaults to the mirrored DRF field's to_representation.
+    """
+    def __init__(self, lookup, relation=None, convert=None):
+        self.lookup = lookup
+        self.relation = relation
+        self.convert = convert
+
+class FastSerializer:
+    """
+    Read-only serializer for list endpoints that builds representations straight from a .values() projection,
+    skipping model instances and DRF's per-field machinery.
+    Output matches serializer_class: the same keys in the same order, converted by the same DRF fields,
+    so both render to identical JSON.
+    """
+    serializer_class = None
+    fields = OrderedDict()
+
+    def __init__(self):
+        declared_fields = self.serializer_class().fields
+
+        # Resolved once per serializer instead of once per row
+        self.accessors = [(name, field.lookup, field.relation, field.convert or declared_fields[name].to_representation)
+                          for name, field in self.fields.items()]
+
+    def get_lookups(self):
+        lookups = []
+
+        for name, lookup, relation, convert in self.accessors:
+            lookups += [lookup] if relation is None else [lookup, relation]
+
+        return lookups
+
+    def values(self, queryset, extra_lookups=()):
+        lookups = self.get_lookups() + list(extra_lookups)
+
+        # Relations are joined by .values() itself
+        return queryset.prefetch_related(None).values(*OrderedDict.fromkeys(lookups))
+
+    def to_representation(self, row):
+        data = OrderedDict()
+
+        for name, lookup, relation, convert in self.accessors:
+            if relation is not None and row[relation] is None:
+                continue
+
+            value = row[lookup]
+            data[name] = None if value is None else convert(value)
+
+        return data
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+def sender_href(sender_id):
+    return Player(user=User(id=sender_id)).get_absolute_url()
+
+def game_href(game_id):
+    return Game(game_id=game_id).get_absolute_url()
+
+class FastGameSerializer(FastSerializer):
+    serializer_class = GameSerializer
+    fields = OrderedDict([
+        ('game_id', FastField('game_id')),
+        ('name', FastField('name')),
+        ('when', FastField('when')),
+        ('where', FastField('where')),
+    ])
+
+class FastNotificationSerializer(FastSerializer):
+    serializer_class = NotificationSerializer
+    fields = OrderedDict([
+        ('id', FastField('id')),
+        ('notification_type', FastField('notification_type')),
+        ('creation_datetime', FastField('creation_datetime')),
+        ('read_datetime', FastField('read_datetime')),
+        ('read', FastField('read')),
+        ('sender', FastField('sender__username', relation='sender')),
+        ('sender_href', FastField('sender', convert=sender_href)),
+        ('game_name', FastField('game__name', relation='game')),
+        ('game_href', FastField('game', relation='game', convert=game_href)),
+    ])
+
+class FastFriendshipSerializer(FastSerializer):
+    serializer_class = FriendshipSerializer
+    fields = OrderedDict([
+        ('id', FastField('id')),
+        ('request_from', FastField('request_from__user__username')),
+        ('request_to', FastField('request_to__user__username')),
+        ('request_datetime', FastField('request_datetime')),
+        ('action_taken_datetime', FastField('action_taken_datetime')),
+        ('state', FastField('state')),
+    ])
+
+class FastGameParticipationRequestSerializer(FastSerializer):
+    serializer_class = GameParticipationRequestSerializer
+    fields = OrderedDict([
+        ('id', FastField('id')),
+        ('request_from', FastField('request_from__user__username')),
+        ('request_to_game', FastField('request_to_game', convert=identity)),
+        ('game_name', FastField('request_to_game__name', convert=identity)),
+        ('request_datetime', FastField('request_datetime')),
+        ('action_taken_datetime', FastField('action_taken_datetime')),
+        ('state', FastField('state')),
+    ])
+
+class FastPlayerSerializer(FastSerializer):
+    """
+    Players with their user and friends nested.
+    Friends of a whole page are read with one query on the friends through table.
+    """
+    serializer_class = PlayerSerializer
+
+    user_fields = ['username', 'email', 'first_name', 'last_name', 'last_login', 'date_joined']
+    friend_user_fields = ['username', 'email', 'first_name', 'last_name']
+
+    def __init__(self):
+        declared_fields = self.serializer_class().fields
+
+        user_serializer_fields = declared_fields['user'].fields
+        friend_serializer_fields = declared_fields['friends'].child.fields['user'].fields
+
+        self.user_accessors = [(name, 'user__' + name, user_serializer_fields[name].to_representation) for name in self.user_fields]
+        self.friend_accessors = [(name, 'to_player__user__' + name, friend_serializer_fields[name].to_representation) for name in self.friend_user_fields]
+
+    def get_lookups(self):
+        return ['id'] + [lookup for name, lookup, convert in self.user_accessors]
+
+    def build_user(self, row, accessors):
+        user = OrderedDict()
+
+        for name, lookup, convert in accessors:
+            value = row[lookup]
+            user[name] = None if value is None else convert(value)
+
+        return user
+
+    def serialize(self, rows):
+        rows = list(rows)
+
+        friends = {row['id']: [] for row in rows}
+
+        friendships = Player.friends.through.objects.filter(from_player_id__in=list(friends)) \
+                                                    .order_by('to_player_id') \
+                                                    .values('from_player_id', *[lookup for name, lookup, convert in self.friend_accessors])
+
+        for friendship in friendships:
+            friends[friendship['from_player_id']].append(OrderedDict([('user', self.build_user(friendship, self.friend_accessors))]))
+
+        return [OrderedDict([('user', self.build_user(row, self.user_accessors)),
+                             ('friends', friends[row['id']])]) for row in rows]
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from game_planner_api.models import NotificationType, Notification, Friendship, GameParticipationRequest
+
+class Command(BaseCommand):
+    help = "Links notifications created before the friendship/participation_request columns existed to the request that created them."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # "X wants to be your friend." was created alongside the friend request
+            friend_requests = Friendship.objects.filter(request_datetime=OuterRef('creation_datetime'),
+                                                        request_from__user=OuterRef('sender'),
+                                                        request_to__user=OuterRef('user'))
+            self.backfill('friendship', NotificationType.FRIEND_REQ, friend_requests)
+
+            # "X accepted your friend request." was created when the request was accepted
+            accepted_friend_requests = Friendship.objects.filter(action_taken_datetime=OuterRef('creation_datetime'),
+                                                                 request_from__user=OuterRef('user'),
+                                                                 request_to__user=OuterRef('sender'),
+                                                                 state="ACTIVE")
+            self.backfill('friendship', NotificationType.ADDED_AS_FRIEND, accepted_friend_requests)
+
+            # "X wants to join Y." was created alongside the participation request
+            participation_requests = GameParticipationRequest.objects.filter(request_datetime=OuterRef('creation_datetime'),
+                                                                             request_from__user=OuterRef('sender'),
+                                                                             request_to_game=OuterRef('game'))
+            self.backfill('participation_request', NotificationType.PARTICIPATION_REQ, participation_requests)
+
+            # "You've been added to Y." was created when the participation request was accepted
+            accepted_participation_requests = GameParticipationRequest.objects.filter(action_taken_datetime=OuterRef('creation_datetime'),
+                                                                                      request_from__user=OuterRef('user'),
+                                                                                      request_to_game=OuterRef('game'),
+                                                                                      state="ACCEPTED")
+            self.backfill('participation_request', NotificationType.ADDED_TO_GAME, accepted_participation_requests)
+
+    def backfill(self, field_name, notification_type, source_queryset):
+        notifications = Notification.objects.filter(**{'notification_type': notification_type.value,
+                                                       field_name + '__isnull': True})
+
+        updated = notifications.update(**{field_name: Subquery(source_queryset.values('pk')[:1])})
+
+        self.stdout.write("%s: %i notifications without a %s processed." % (notification_type.name, updated, field_name))
@@ -0,0 +1,77 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from game_planner_api.models import Game, pkgen
+
+class Command(BaseCommand):
+    help = "Measures game creation throughput (games/s) with concurrent writers using Game.objects.create_with_generated_id()."
+
+    def add_arguments(self, parser):
+        parser.add_argument('admin', help="Username the benchmark games are created for.")
+        parser.add_argument('--threads', type=int, default=4,
+                            help="Concurrent writers, each with its own database connection.")
+        parser.add_argument('--games', type=int, default=250,
+                            help="Games created by each writer.")
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the benchmark games instead of deleting them afterwards.")
+
+    def handle(self, *args, **options):
+        try:
+            admin = User.objects.get(username=options['admin'])
+        except User.DoesNotExist:
+            raise CommandError("User '%s' not found." % options['admin'])
+
+        start = time.perf_counter()
+        ids = [pkgen() for i in range(100000)]
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write("pkgen(): %.0f ids/s, %i duplicates in %i." % (len(ids) / elapsed, len(ids) - len(set(ids)), len(ids)))
+
+        created = []
+        errors = []
+
+        def writer(number):
+            try:
+                for i in range(options['games']):
+                    game = Game.objects.create_with_generated_id(name='benchmark %i-%i' % (number, i),
+                                                                 admin=admin,
+                                                                 when=timezone.now(),
+                                                                 where='benchmark',
+                                                                 price=0,
+                                                                 duration=timedelta(hours=1),
+                                                                 private=True)
+                    created.append(game.game_id)
+            except Exception as exception:
+                errors.append(exception)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(number,)) for number in range(options['threads'])]
+
+        start = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write("%i writers created %i games in %.2fs (%.0f games/s), %i failed." % (options['threads'],
+                                                                                              len(created),
+                                                                                              elapsed,
+                                                                                              len(created) / elapsed,
+                                                                                              len(errors)))
+
+        for error in errors:
+            self.stderr.write(str(error))
+
+        if not options['keep']:
+            Game.objects.filter(pk__in=created).delete()
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rest_framework.renderers import JSONRenderer
+
+from game_planner_api.models import Player, Game, Notification, Friendship, GameParticipationRequest
+from game_planner_api.fast_serializers import FastPlayerSerializer, FastGameSerializer, FastNotificationSerializer, FastFriendshipSerializer, FastGameParticipationRequestSerializer
+
+class Command(BaseCommand):
+    help = "Compares serialization throughput (rows/s) of the DRF list serializers and their fast counterparts on existing data."
+
+    benchmarks = [
+        (Player, FastPlayerSerializer),
+        (Game, FastGameSerializer),
+        (Notification, FastNotificationSerializer),
+        (Friendship, FastFriendshipSerializer),
+        (GameParticipationRequest, FastGameParticipationRequestSerializer),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help="Rows serialized per run.")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Runs per serializer, the fastest one is reported.")
+
+    def handle(self, *args, **options):
+        for model, fast_serializer_class in self.benchmarks:
+            serializer_class = fast_serializer_class.serializer_class
+            queryset = model.objects.order_by('pk')[:options['rows']]
+
+            # Both timings include the queries and rendering, as a list request would
+            def drf():
+                instances = serializer_class.setup_eager_loading(queryset) if hasattr(serializer_class, 'setup_eager_loading') else queryset
+                return JSONRenderer().render(serializer_class(instances, many=True).data)
+
+            def fast():
+                fast_serializer = fast_serializer_class()
+                return JSONRenderer().render(fast_serializer.serialize(fast_serializer.values(queryset)))
+
+            rows = queryset.count()
+
+            if not rows:
+                self.stdout.write("%s: no rows, skipped." % model.__name__)
+                continue
+
+            drf_elapsed = self.measure(drf, options['repeat'])
+            fast_elapsed = self.measure(fast, options['repeat'])
+
+            identical = drf() == fast()
+
+            self.stdout.write("%s: %i rows, DRF %.0f rows/s, fast %.0f rows/s (x%.1f)%s" % (model.__name__,
+                                                                                             rows,
+                                                                                             rows / drf_elapsed,
+                                                                                             rows / fast_elapsed,
+                                                                                             drf_elapsed / fast_elapsed,
+                                                                                             "" if identical else ", OUTPUT DIFFERS"))
+
+    def measure(self, function, repeat):
+        best = None
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+
+            best = elapsed if best is None else min(best, elapsed)
+
+        return best
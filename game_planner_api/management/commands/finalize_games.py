@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from game_planner_api.models import Game
+
+class Command(BaseCommand):
+    help = "Finalizes the rosters of games that have already taken place, counting them in their players' number_of_games_played."
+
+    def handle(self, *args, **options):
+        game_ids = list(Game.objects.filter(finalized=False, when__lt=timezone.now()).values_list('pk', flat=True))
+
+        finalized = sum(Game(pk=game_id).finalize() for game_id in game_ids)
+
+        self.stdout.write("%i games finalized." % finalized)
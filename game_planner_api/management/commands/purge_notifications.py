@@ -0,0 +1,101 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from game_planner_api.models import Notification, NotificationDeletion
+
+class Command(BaseCommand):
+    help = "Purges read notifications older than --days, and read notifications beyond the newest --keep of each user, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90),
+                            help="Purge read notifications created more than this many days ago.")
+        parser.add_argument('--keep', type=int, default=getattr(settings, 'NOTIFICATION_RETENTION_PER_USER', None),
+                            help="Purge read notifications beyond the newest KEEP of each user.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to wait between batches.")
+        parser.add_argument('--archive', metavar='FILE',
+                            help="Append purged notifications to FILE as JSON lines before deleting them.")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+        self.archive = open(options['archive'], 'a') if options['archive'] else None
+
+        start = time.monotonic()
+        purged = 0
+
+        try:
+            # Unread notifications are never purged
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            purged += self.purge(Notification.objects.filter(read=True, creation_datetime__lt=cutoff).order_by())
+
+            if options['keep'] is not None:
+                users_over_cap = Notification.objects.filter(read=True) \
+                                                     .order_by() \
+                                                     .values('user') \
+                                                     .annotate(count=Count('pk')) \
+                                                     .filter(count__gt=options['keep']) \
+                                                     .values_list('user', flat=True)
+
+                for user_id in list(users_over_cap):
+                    excess = Notification.objects.filter(user=user_id, read=True).order_by('-creation_datetime', '-id')[options['keep']:]
+                    purged += self.purge(excess)
+
+            # Tombstones only need to outlive the polls that haven't seen them yet
+            tombstone_cutoff = timezone.now() - timedelta(days=getattr(settings, 'NOTIFICATION_DELETION_RETENTION_DAYS', 7))
+            self.purge_deletions(NotificationDeletion.objects.filter(deleted_at__lt=tombstone_cutoff).order_by())
+        finally:
+            if self.archive:
+                self.archive.close()
+
+        elapsed = time.monotonic() - start
+
+        self.stdout.write("Purged %i notifications in %.2fs (%.0f rows/s)." % (purged, elapsed, purged / elapsed if elapsed else 0))
+
+    def purge(self, queryset):
+        purged = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(queryset.values_list('pk', flat=True)[:self.batch_size])
+
+                if not batch:
+                    return purged
+
+                # Still read, so no unread counter changes
+                notifications = Notification.objects.filter(pk__in=batch, read=True)
+
+                if self.archive:
+                    for notification in notifications.values():
+                        self.archive.write(json.dumps(notification, cls=DjangoJSONEncoder) + "\n")
+
+                # Clients have long seen these as read, and polls don't need a tombstone per purged row:
+                # the plain QuerySet.delete() skips NotificationQuerySet's tombstones and poll wake-ups
+                models.QuerySet.delete(notifications)
+
+            purged += len(batch)
+
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def purge_deletions(self, queryset):
+        while True:
+            batch = list(queryset.values_list('pk', flat=True)[:self.batch_size])
+
+            if not batch:
+                return
+
+            NotificationDeletion.objects.filter(pk__in=batch).delete()
+
+            if self.sleep:
+                time.sleep(self.sleep)
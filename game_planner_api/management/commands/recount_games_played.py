@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from game_planner_api.models import Player
+
+class Command(BaseCommand):
+    help = "Recomputes every player's number_of_games_played from the rosters of finalized games."
+
+    def handle(self, *args, **options):
+        updated = Player.recount_games_played()
+
+        self.stdout.write("Games played recomputed for %i players." % updated)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+
+from game_planner_api.models import Player
+
+class Command(BaseCommand):
+    help = "Recomputes every player's unread notification counter from the notifications table."
+
+    def handle(self, *args, **options):
+        Player.recount_unread_notifications(User.objects.values('pk'))
+
+        self.stdout.write("Unread notification counters recomputed for %i players." % Player.objects.count())
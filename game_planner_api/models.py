@@ -1,39 +1,249 @@
+import itertools
+import secrets
+import string
+import time
 from datetime import date, datetime
 from enum import Enum
 
-from django.db import models
+from collections import Counter
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .notification_broker import get_broker
+from .social_graph import get_social_graph
+from .versioning import bump_versions, payload_cache_enabled
+
+BASE36_DIGITS = string.digits + string.ascii_lowercase
+
+# Milliseconds are counted from here so the time part fits 8 base36 characters until 2108
+PKGEN_EPOCH_MS = 1546300800000
+
 def pkgen(stringLength=12):
-    import random
-    import string
+    """
+    Time ordered, collision resistant id: 8 base36 characters of milliseconds followed by
+    stringLength - 8 characters from the secrets module (1.6M combinations per millisecond for 12).
+    Ids sort by creation time, so inserts land at the end of the primary key index.
+    """
+    milliseconds = int(time.time() * 1000) - PKGEN_EPOCH_MS
+
+    time_part = ''
+    for i in range(8):
+        milliseconds, digit = divmod(milliseconds, 36)
+        time_part = BASE36_DIGITS[digit] + time_part
 
-    lettersAndDigits = string.ascii_lowercase + string.digits
-    return ''.join(random.choice(lettersAndDigits) for i in range(stringLength))
+    return time_part + ''.join(secrets.choice(BASE36_DIGITS) for i in range(stringLength - 8))
 
 class Player(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     friends = models.ManyToManyField("self", blank=True)
     number_of_games_played = models.IntegerField(default=0)
+    unread_notifications = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-number_of_games_played', 'id'], name='player_games_played_idx'),
+        ]
 
     def __str__(self):
         string = self.user.username
         return string
 
     def get_absolute_url(self):
-        return "/profile/%i" % self.user.id
+        return "/profile/%i" % self.user_id
+
+    def is_friend_with(self, player):
+        """
+        Single indexed EXISTS query instead of loading the whole friends list.
+        """
+        return self.friends.filter(pk=player.pk).exists()
+
+    @staticmethod
+    def add_unread_notifications(user_id, delta):
+        """
+        Atomically adds delta to the unread notification counter of user_id's player.
+        """
+        Player.objects.filter(user_id=user_id).update(unread_notifications=F('unread_notifications') + delta)
+
+    @staticmethod
+    def recount_unread_notifications(user_ids):
+        """
+        Recomputes the unread notification counter of the players of user_ids in a single UPDATE.
+        """
+        unread_count = Notification.objects.filter(user=OuterRef('user'), read=False) \
+                                           .order_by() \
+                                           .values('user') \
+                                           .annotate(count=models.Count('pk')) \
+                                           .values('count')
+
+        Player.objects.filter(user_id__in=user_ids).update(unread_notifications=Coalesce(Subquery(unread_count), 0))
+
+    @staticmethod
+    def recount_games_played(player_ids=None):
+        """
+        Recomputes number_of_games_played from the finalized games' rosters in a single UPDATE,
+        for the players of player_ids or for every player.
+        """
+        games_played = Game.players.through.objects.filter(player=OuterRef('pk'), game__finalized=True) \
+                                                   .order_by() \
+                                                   .values('player') \
+                                                   .annotate(count=models.Count('pk')) \
+                                                   .values('count')
+
+        players = Player.objects.all() if player_ids is None else Player.objects.filter(pk__in=player_ids)
+
+        return players.update(number_of_games_played=Coalesce(Subquery(games_played), 0))
+
+def is_primary_key_violation(error, model):
+    """
+    Whether an IntegrityError comes from a duplicate primary key of model, judged from the database error itself.
+    Reading the table afterwards instead could miss a row committed by another transaction (REPEATABLE READ snapshots).
+    """
+    cause = error.__cause__ or error
+    table = model._meta.db_table
+    column = model._meta.pk.column
+    message = str(cause)
+
+    # MySQL: 1062 Duplicate entry '...' for key 'PRIMARY' (or '<table>.PRIMARY' from 8.0.19)
+    if cause.args and cause.args[0] == 1062:
+        return "PRIMARY'" in message
+
+    # PostgreSQL
+    diag = getattr(cause, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name == '%s_pkey' % table
+
+    # SQLite
+    return message == 'UNIQUE constraint failed: %s.%s' % (table, column)
+
+class GameQuerySet(models.QuerySet):
+
+    def name_taken(self, admin, name):
+        """
+        Indexed EXISTS on the (admin, name) unique constraint.
+        """
+        return self.filter(admin=admin, name=name).exists()
+
+    def create_with_generated_id(self, players=None, **fields):
+        """
+        Inserts a game under a new pkgen() id, relying on the primary key constraint instead of checking for a free id first.
+        Only retried, with a new id, in the unlikely case the id was taken.
+        The optional players roster is written in bulk in the same transaction.
+        """
+        with transaction.atomic(using=self.db):
+            for attempt in range(Game.ID_ATTEMPTS):
+                game = self.model(game_id=pkgen(), **fields)
+
+                try:
+                    with transaction.atomic(using=self.db):
+                        game.save(force_insert=True, using=self.db)
+                except IntegrityError as error:
+                    # Other constraints fail the same way, those aren't retried
+                    if attempt == Game.ID_ATTEMPTS - 1 or not is_primary_key_violation(error, Game):
+                        raise
+                else:
+                    break
+
+            if players:
+                game.players.add(*players)
+
+        return game
+
+    def public(self):
+        return self.filter(private=False)
+
+    def administered_by(self, user):
+        return self.filter(admin=user)
+
+    def with_player(self, player):
+        return self.filter(players=player)
+
+    def visible_to(self, user):
+        """
+        Public games, games administered by user and games user plays in.
+        Each condition is an indexed lookup, the players one a subquery on the through table,
+        so there is no join over the players M2M and no DISTINCT.
+        """
+        visible = Q(private=False)
+
+        if user is not None and user.is_authenticated:
+            player_games = Game.players.through.objects.filter(player__user=user).values('game_id')
+
+            visible = visible | Q(admin=user) | Q(pk__in=player_games)
+
+        return self.filter(visible)
+
+    def _before_delete(self, notifications=None):
+        """
+        Prepares the deletion of the games in the queryset, along with notifications (by default the games' own).
+        Returns a function that updates the counters of the players involved and the social graph once they are deleted.
+        """
+        if notifications is None:
+            notifications = Notification.objects.filter(game__in=self)
+
+        after_notifications_delete = notifications._before_delete()
+
+        # Former players of finalized games have played one game less
+        player_ids = list(Game.players.through.objects.filter(game__in=self.filter(finalized=True))
+                                                      .order_by()
+                                                      .values_list('player', flat=True)
+                                                      .distinct())
+        game_ids = list(self.order_by().values_list('pk', flat=True))
+
+        def after_delete():
+            after_notifications_delete()
+
+            if player_ids:
+                Player.recount_games_played(player_ids)
+
+            transaction.on_commit(lambda: [get_social_graph().remove_game(game_id) for game_id in game_ids])
+
+        return after_delete
+
+    def delete(self):
+        # Notifications, rosters and the social graph follow the deleted games
+        with transaction.atomic(using=self.db):
+            after_delete = self._before_delete()
+            result = super().delete()
+            after_delete()
+
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class Game(models.Model):
     game_id = models.CharField(primary_key=True, max_length=12, editable=False)
     name = models.CharField(max_length=30)
     admin = models.ForeignKey(User, on_delete=models.CASCADE, related_name='game_admin')
-    when = models.DateTimeField()
+    when = models.DateTimeField(db_index=True)
     where = models.CharField(max_length=60)
     players = models.ManyToManyField(Player)
     price = models.IntegerField()
     duration = models.DurationField()
     private = models.BooleanField(default=False)
+    finalized = models.BooleanField(default=False)
+
+    objects = GameQuerySet.as_manager()
+
+    # Inserts tried by create_with_generated_id() before giving up
+    ID_ATTEMPTS = 5
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['private', 'when'], name='game_private_when_idx'),
+            models.Index(fields=['finalized', 'when'], name='game_finalized_when_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['admin', 'name'], name='game_admin_name_unique'),
+        ]
+
+    DUPLICATE_NAME_MESSAGE = "You already have a game with this name. Please choose a different one."
 
     def __str__(self):
         return str(self.when) + " - " + self.name
@@ -47,12 +257,180 @@ class Game(models.Model):
     def is_in_the_future(self):
         return self.when.replace(tzinfo=None) > datetime.now()
 
+    def has_player(self, player):
+        """
+        Single indexed EXISTS query instead of loading the whole players list.
+        """
+        return self.players.filter(pk=player.pk).exists()
+
+    def is_visible_to(self, user):
+        """
+        Same rule as GameQuerySet.visible_to() for a single game.
+        """
+        if not self.private:
+            return True
+
+        if user is None or not user.is_authenticated:
+            return False
+
+        return self.admin_id == user.pk or self.players.filter(user=user).exists()
+
+    def update(self, players=None, **fields):
+        """
+        Writes only the given fields, and replaces the roster if players is given, in one transaction.
+        """
+        with transaction.atomic():
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+            if fields:
+                self.save(update_fields=list(fields))
+
+            if players is not None:
+                self.players.set(players)
+
+    def finalize(self):
+        """
+        Counts this game in number_of_games_played of every player on its roster.
+        Returns False if the game had already been finalized.
+        """
+        with transaction.atomic():
+            # Conditional UPDATE so a game finalized concurrently is only counted once
+            finalized = Game.objects.filter(pk=self.pk, finalized=False).update(finalized=True)
+
+            if finalized:
+                roster = Game.players.through.objects.filter(game=self.pk).values('player')
+                Player.objects.filter(pk__in=roster).update(number_of_games_played=F('number_of_games_played') + 1)
+
+        self.finalized = True
+
+        return bool(finalized)
+
+    def delete(self, *args, **kwargs):
+        # Same as GameQuerySet.delete()
+        with transaction.atomic():
+            after_delete = Game.objects.filter(pk=self.pk)._before_delete()
+            result = super().delete(*args, **kwargs)
+            after_delete()
+
+        return result
+
 class NotificationType(Enum):
     FRIEND_REQ = 0
     PARTICIPATION_REQ = 1
     ADDED_AS_FRIEND = 2
     ADDED_TO_GAME = 3
 
+def publish_notification_changes(user_ids):
+    """
+    Wakes up the users' notification long-polls once the current transaction commits.
+    """
+    broker = get_broker()
+
+    def publish():
+        for user_id in user_ids:
+            broker.publish(user_id)
+
+    transaction.on_commit(publish)
+
+class NotificationQuerySet(models.QuerySet):
+    """
+    Keeps Player.unread_notifications in step with every bulk change to notifications.
+    """
+
+    def _set_read(self, notifications, **fields):
+        with transaction.atomic():
+            user_ids = list(notifications.order_by().values_list('user', flat=True).distinct())
+
+            if not user_ids:
+                return 0
+
+            count = notifications.update(updated_at=timezone.now(), **fields)
+
+            if len(user_ids) == 1:
+                delta = -count if fields['read'] else count
+                Player.add_unread_notifications(user_ids[0], delta)
+            else:
+                Player.recount_unread_notifications(user_ids)
+
+            publish_notification_changes(user_ids)
+
+        return count
+
+    def mark_as_read(self, read_datetime=None):
+        """
+        Marks every unread notification in the queryset as read with a single UPDATE.
+        Returns the number of notifications marked as read.
+        """
+        if read_datetime is None:
+            read_datetime = timezone.now()
+
+        return self._set_read(self.filter(read=False), read=True, read_datetime=read_datetime)
+
+    def mark_as_unread(self):
+        """
+        Marks every read notification in the queryset as unread with a single UPDATE.
+        Returns the number of notifications marked as unread.
+        """
+        return self._set_read(self.filter(read=True), read=False, read_datetime=None)
+
+    def record_deletions(self):
+        """
+        Writes a NotificationDeletion for every notification in the queryset, about to be deleted.
+        Returns the ids of their users.
+        """
+        deleted_at = timezone.now()
+        rows = list(self.order_by().values_list('pk', 'user'))
+
+        NotificationDeletion.objects.bulk_create([NotificationDeletion(notification_id=notification_id, user_id=user_id, deleted_at=deleted_at)
+                                                  for notification_id, user_id in rows])
+
+        return set(user_id for notification_id, user_id in rows)
+
+    def _before_delete(self):
+        """
+        Writes the tombstones of the notifications in the queryset, about to be deleted.
+        Returns a function that updates their users' unread counters and polls once they are deleted.
+        """
+        user_ids = list(self.filter(read=False).order_by().values_list('user', flat=True).distinct())
+        notified_user_ids = self.record_deletions()
+
+        def after_delete():
+            if user_ids:
+                Player.recount_unread_notifications(user_ids)
+
+            publish_notification_changes(notified_user_ids)
+
+        return after_delete
+
+    def delete(self):
+        with transaction.atomic():
+            after_delete = self._before_delete()
+            result = super().delete()
+            after_delete()
+
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+
+            unread_per_user = Counter(notification.user_id for notification in objs if not notification.read)
+
+            # Same as _set_read(): a delta for a single user, one recounting UPDATE for many
+            if len(unread_per_user) == 1:
+                for user_id, count in unread_per_user.items():
+                    Player.add_unread_notifications(user_id, count)
+            elif unread_per_user:
+                Player.recount_unread_notifications(list(unread_per_user))
+
+            publish_notification_changes(set(notification.user_id for notification in objs))
+
+        return objs
+
 class Notification(models.Model):
     notification_type = models.IntegerField()
     creation_datetime = models.DateTimeField()
@@ -61,6 +439,82 @@ class Notification(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='sender')
     game = models.ForeignKey(Game, on_delete=models.CASCADE, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user')
+    friendship = models.ForeignKey('Friendship', on_delete=models.SET_NULL, null=True, blank=True)
+    participation_request = models.ForeignKey('GameParticipationRequest', on_delete=models.SET_NULL, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'read', 'creation_datetime'], name='notif_user_read_idx'),
+            models.Index(fields=['read', 'creation_datetime'], name='notif_read_created_idx'),
+            models.Index(fields=['user', 'updated_at'], name='notif_user_updated_idx'),
+            models.Index(fields=['user', 'notification_type', 'read'], name='notif_user_type_idx'),
+            models.Index(fields=['notification_type', 'creation_datetime', 'user', 'read'], name='notif_source_lookup_idx'),
+        ]
+
+    def _store_read(self, read):
+        """
+        Writes read to the row if the stored state differs, returning how the unread counter changes.
+        Filtering the UPDATE on the old value counts each change once, whatever this instance last read
+        from the database and however many saves of the row run concurrently.
+        """
+        changed = Notification.objects.filter(pk=self.pk, read=not read).update(read=read)
+
+        return -changed if read else changed
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields', None)
+
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                delta = 0 if self.read else 1
+
+            elif update_fields is None or 'read' in update_fields:
+                delta = self._store_read(self.read)
+                super().save(*args, **kwargs)
+
+            else:
+                delta = 0
+                super().save(*args, **kwargs)
+
+            if delta:
+                Player.add_unread_notifications(self.user_id, delta)
+
+            publish_notification_changes([self.user_id])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # Counted as unread only if the row still was when this transaction got to it
+            delta = self._store_read(True)
+
+            NotificationDeletion.objects.create(notification_id=self.pk, user_id=self.user_id, deleted_at=timezone.now())
+
+            result = super().delete(*args, **kwargs)
+
+            if delta:
+                Player.add_unread_notifications(self.user_id, delta)
+
+            publish_notification_changes([self.user_id])
+
+        return result
+
+class NotificationDeletion(models.Model):
+    """
+    Tombstone of a deleted notification, so notification polls can tell clients to drop it.
+    Ordered with notifications by (deleted_at, notification_id) like they are by (updated_at, id).
+    """
+    notification_id = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'notification_id'], name='notif_deletion_user_idx'),
+            models.Index(fields=['deleted_at'], name='notif_deletion_when_idx'),
+        ]
 
 class Friendship(models.Model):
     request_from = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='friendship_request_from')
@@ -71,6 +525,9 @@ class Friendship(models.Model):
 
     class Meta:
         ordering = ['-request_datetime']
+        indexes = [
+            models.Index(fields=['request_from', 'request_to', 'state'], name='friendship_from_to_state_idx'),
+        ]
 
     def __str__(self):
         return "Friendship request from " + self.request_from.user.username + " to " + self.request_to.user.username
@@ -84,6 +541,129 @@ class GameParticipationRequest(models.Model):
 
     class Meta:
         ordering = ['-request_datetime']
+        indexes = [
+            models.Index(fields=['request_from', 'request_to_game', 'state'], name='participation_from_game_idx'),
+        ]
 
     def __str__(self):
-        return "Game participation request from " + self.request_from.user.username + " to " + self.request_to_game.name
\ No newline at end of file
+        return "Game participation request from " + self.request_from.user.username + " to " + self.request_to_game.name
+
+@receiver(m2m_changed, sender=Game.players.through)
+def recount_games_played_on_roster_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps number_of_games_played correct when the roster of a finalized game changes afterwards.
+    """
+    if reverse:
+        # player.game_set changed, instance is the player
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Player.recount_games_played([instance.pk])
+
+    elif instance.finalized:
+        if action == 'pre_clear':
+            instance._cleared_player_ids = list(instance.players.values_list('pk', flat=True))
+
+        elif action == 'post_clear':
+            Player.recount_games_played(instance._cleared_player_ids)
+
+        elif action in ('post_add', 'post_remove'):
+            Player.recount_games_played(pk_set)
+
+@receiver(pre_delete, sender=User)
+def prepare_cascaded_deletions(sender, instance, **kwargs):
+    """
+    The games the user administers, their notifications and the notifications the user sent are deleted along with the user.
+    The user's own notifications and tombstones go with it, so no tombstones are written for them.
+    """
+    games = Game.objects.filter(admin=instance)
+    notifications = Notification.objects.filter(Q(sender=instance) | Q(game__in=games)).exclude(user=instance)
+
+    instance._after_delete = games._before_delete(notifications)
+
+@receiver(post_delete, sender=User)
+def finish_cascaded_deletions(sender, instance, **kwargs):
+    after_delete = getattr(instance, '_after_delete', None)
+
+    if after_delete is not None:
+        after_delete()
+
+@receiver(m2m_changed, sender=Player.friends.through)
+def update_social_graph_on_friends_change(sender, instance, action, pk_set, **kwargs):
+    """
+    Applies friendship changes to the in-process social graph once they are committed.
+    """
+    graph = get_social_graph()
+
+    if action == 'post_add':
+        transaction.on_commit(lambda: [graph.add_friendship(instance.pk, friend_id) for friend_id in pk_set])
+
+    elif action == 'post_remove':
+        transaction.on_commit(lambda: [graph.remove_friendship(instance.pk, friend_id) for friend_id in pk_set])
+
+    elif action == 'post_clear':
+        transaction.on_commit(graph.invalidate)
+
+@receiver(m2m_changed, sender=Game.players.through)
+def update_social_graph_on_roster_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Applies roster changes to the in-process social graph once they are committed.
+    """
+    graph = get_social_graph()
+
+    if action in ('post_add', 'post_remove'):
+        update = graph.add_player_to_game if action == 'post_add' else graph.remove_player_from_game
+
+        if reverse:
+            changes = [(game_id, instance.pk) for game_id in pk_set]
+        else:
+            changes = [(instance.pk, player_id) for player_id in pk_set]
+
+        transaction.on_commit(lambda: [update(game_id, player_id) for game_id, player_id in changes])
+
+    elif action == 'post_clear':
+        transaction.on_commit(graph.invalidate)
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+def bump_game_version(sender, instance, **kwargs):
+    bump_versions('game', [instance.pk])
+
+@receiver(m2m_changed, sender=Game.players.through)
+def bump_game_version_on_roster_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        bump_versions('game', pk_set if reverse else [instance.pk])
+
+    elif action == 'pre_clear':
+        bump_versions('game', instance.game_set.values_list('pk', flat=True) if reverse else [instance.pk])
+
+@receiver(pre_save, sender=User)
+def remember_stored_username(sender, instance, update_fields, **kwargs):
+    # A rename moves the user's player payload to a new key and changes game payloads listing the user
+    if payload_cache_enabled() and instance.pk is not None and (update_fields is None or 'username' in update_fields):
+        instance._stored_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+@receiver(post_save, sender=User)
+def bump_versions_on_user_change(sender, instance, created, **kwargs):
+    if created:
+        bump_versions('player', [instance.username])
+        return
+
+    # Friends' representations include the user's names and email as well
+    bump_versions('player', itertools.chain([instance.username],
+                                            User.objects.filter(player__friends__user=instance).values_list('username', flat=True)))
+
+    stored_username = getattr(instance, '_stored_username', None)
+
+    if stored_username is not None and stored_username != instance.username:
+        bump_versions('player', [stored_username])
+        bump_versions('game', Game.objects.filter(Q(players__user=instance) | Q(admin=instance)).values_list('pk', flat=True).distinct())
+
+@receiver(m2m_changed, sender=Player.friends.through)
+def bump_player_versions_on_friends_change(sender, instance, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        player_ids = [instance.pk] + list(pk_set)
+    elif action == 'pre_clear':
+        player_ids = [instance.pk] + list(instance.friends.values_list('pk', flat=True))
+    else:
+        return
+
+    bump_versions('player', User.objects.filter(player__in=player_ids).values_list('username', flat=True))
@@ -0,0 +1,44 @@
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+class LocalBroker:
+    """
+    In-process broker used when no external one is configured.
+    Only wakes up long-poll requests served by the same process.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def version(self, user_id):
+        with self._condition:
+            return self._versions.get(user_id, 0)
+
+    def publish(self, user_id):
+        with self._condition:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, version, timeout):
+        """
+        Blocks until something is published for user_id after version was read, or until timeout seconds pass.
+        Returns True if woken up by a publish.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._versions.get(user_id, 0) != version, timeout)
+
+_broker = None
+
+def get_broker():
+    """
+    Returns the broker configured in settings.NOTIFICATION_BROKER, defaulting to LocalBroker.
+    """
+    global _broker
+
+    if _broker is None:
+        broker_class = import_string(getattr(settings, 'NOTIFICATION_BROKER', 'game_planner_api.notification_broker.LocalBroker'))
+        _broker = broker_class()
+
+    return _broker
@@ -0,0 +1,137 @@
+from base64 import b64decode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+
+def reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+def keyset_after(ordering, row):
+    """
+    Q for the rows that come after row in ordering, e.g. ('-when', 'pk') gives when < x OR (when = x AND pk > y).
+    row is a model instance, or a dict of the ordering fields.
+    """
+    after = Q()
+    equal = {}
+
+    for field in ordering:
+        name = field.lstrip('-')
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+
+        after |= Q(**equal, **{'%s__%s' % (name, 'lt' if field.startswith('-') else 'gt'): value})
+        equal[name] = value
+
+    return after
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over a stable, indexed ordering whose last field is unique.
+    Cursors are opaque and hold the values of every ordering field of the row at the page edge,
+    so pages are fetched with a WHERE on the whole ordering key instead of an OFFSET, however many rows tie.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+
+        if self.cursor is not None:
+            position = dict(zip((field.lstrip('-') for field in ordering), self.cursor.position))
+
+            try:
+                queryset = queryset.filter(keyset_after(ordering, position))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # One extra row tells whether there is a page following this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        position = self.get_position(self.page[-1]) if self.page else self.cursor.position
+
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        position = self.get_position(self.page[0]) if self.page else self.cursor.position
+
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_position(self, row):
+        names = [field.lstrip('-') for field in self.ordering]
+
+        return [str(row[name] if isinstance(row, dict) else getattr(row, name)) for name in names]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if encoded is None:
+            return None
+
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+class PlayerPagination(KeysetPagination):
+    ordering = ('id',)
+
+class LeaderboardPagination(KeysetPagination):
+    # Top 10 unless ?page_size= asks for another K
+    page_size = 10
+    ordering = ('-number_of_games_played', 'id')
+
+class GamePagination(KeysetPagination):
+    ordering = ('when', 'game_id')
+
+class NotificationPagination(KeysetPagination):
+    ordering = ('-creation_datetime', '-id')
+
+class FriendshipPagination(KeysetPagination):
+    ordering = ('-request_datetime', '-id')
+
+class GameParticipationRequestPagination(KeysetPagination):
+    ordering = ('-request_datetime', '-id')
@@ -0,0 +1,188 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Lists of placeholders grow with the number of values, IN (%s, %s) and IN (%s) are the same query
+PLACEHOLDER_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+def sql_shape(sql):
+    return PLACEHOLDER_LIST_RE.sub('(...)', sql)
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper() that counts the queries run through it, the time spent in them
+    and how many times each SQL shape was executed.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """
+        Shapes executed at least threshold times, typically one query per row of a list (N+1).
+        """
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+@contextmanager
+def record_queries(recorder=None):
+    """
+    Records the queries of the current thread on every database connection while the block runs,
+    into recorder or a new QueryRecorder.
+    """
+    if recorder is None:
+        recorder = QueryRecorder()
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+        yield recorder
+
+def repeat_threshold():
+    return getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 3)
+
+class QueryStats:
+    """
+    Per-view totals of the requests seen by QueryBudgetMiddleware in this process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, recorder, repeated):
+        with self._lock:
+            view = self._views.setdefault(view_name, {'requests': 0,
+                                                      'queries': 0,
+                                                      'max_queries': 0,
+                                                      'db_time': 0.0,
+                                                      'repeated_shapes': Counter()})
+
+            view['requests'] += 1
+            view['queries'] += recorder.count
+            view['max_queries'] = max(view['max_queries'], recorder.count)
+            view['db_time'] += recorder.duration
+            view['repeated_shapes'].update(repeated.keys())
+
+    def snapshot(self):
+        with self._lock:
+            return {view_name: {'requests': view['requests'],
+                                'queries': view['queries'],
+                                'avg_queries': view['queries'] / view['requests'],
+                                'max_queries': view['max_queries'],
+                                'avg_db_time_ms': view['db_time'] * 1000 / view['requests'],
+                                # Shape: number of requests in which it was repeated
+                                'repeated_shapes': dict(view['repeated_shapes'])}
+                    for view_name, view in self._views.items()}
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+_stats = None
+
+def get_query_stats():
+    global _stats
+
+    if _stats is None:
+        _stats = QueryStats()
+
+    return _stats
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries and database time of each request, warns about SQL shapes repeated
+    settings.QUERY_BUDGET_REPEAT_THRESHOLD or more times and keeps per-view totals in get_query_stats().
+    With settings.QUERY_BUDGET_HEADERS (defaults to DEBUG) the numbers are also sent as X-Query-* headers,
+    except on streaming responses: their queries run while the body is sent, and are reported once it ends.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self.record_stream(request, response.streaming_content, recorder)
+            return response
+
+        self.report(request, recorder)
+
+        if getattr(settings, 'QUERY_BUDGET_HEADERS', settings.DEBUG):
+            response['X-Query-Count'] = recorder.count
+            response['X-Query-Time'] = '%.3f' % (recorder.duration * 1000)
+            response['X-Query-Repeated'] = max(recorder.shapes.values(), default=0)
+
+        return response
+
+    def record_stream(self, request, streaming_content, recorder):
+        chunks = iter(streaming_content)
+        end = object()
+
+        try:
+            while True:
+                # Only while producing a chunk, not while the server sends it. Streamed lists run the same queries
+                # for every chunk of rows, so repeats are counted within a chunk.
+                with record_queries() as chunk_recorder:
+                    chunk = next(chunks, end)
+
+                recorder.count += chunk_recorder.count
+                recorder.duration += chunk_recorder.duration
+                recorder.shapes |= chunk_recorder.shapes
+
+                if chunk is end:
+                    return
+
+                yield chunk
+        finally:
+            self.report(request, recorder)
+
+    def report(self, request, recorder):
+        repeated = recorder.repeated(repeat_threshold())
+
+        for shape, count in repeated.items():
+            logger.warning("%s %s ran the same query %i times: %s", request.method, request.path, count, shape)
+
+        match = getattr(request, 'resolver_match', None)
+
+        if match is not None:
+            get_query_stats().record(match.view_name, recorder, repeated)
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin to hold views to a query budget.
+    """
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_repeats=1):
+        """
+        Fails if the block runs more than max_queries queries, or any SQL shape more than max_repeats times.
+        """
+        with record_queries() as recorder:
+            yield recorder
+
+        shapes = '\n'.join('%i x %s' % (count, shape) for shape, count in recorder.shapes.most_common())
+
+        self.assertLessEqual(recorder.count, max_queries,
+                             "%i queries executed, budget is %i:\n%s" % (recorder.count, max_queries, shapes))
+
+        self.assertFalse(recorder.repeated(max_repeats + 1),
+                         "A query was repeated more than %i times:\n%s" % (max_repeats, shapes))
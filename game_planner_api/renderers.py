@@ -0,0 +1,40 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+def ndjson_line(data):
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')) + "\n"
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON, one object per line.
+    Large list responses are streamed by StreamingListMixin, this renders everything else (e.g. errors) in the same format.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if isinstance(data, list):
+            return ''.join(ndjson_line(item) for item in data).encode(self.charset)
+
+        return ndjson_line(data).encode(self.charset)
+
+class ICalendarRenderer(BaseRenderer):
+    """
+    Lets calendar clients ask for text/calendar. Calendars are streamed by GameCalendar,
+    this renders everything else (e.g. errors) as JSON text.
+    """
+    media_type = 'text/calendar'
+    format = 'ics'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False).encode(self.charset)
@@ -1,9 +1,32 @@
 from django.contrib.auth.models import User
+from django.db.models import Count, Prefetch
 
 from rest_framework import serializers
 
 from .models import Player, Game, Notification, Friendship, GameParticipationRequest
 
+class EagerLoadingMixin:
+    """
+    Lets a serializer declare the relations and aggregates it reads so views can load them up front
+    instead of issuing one query per serialized row.
+    """
+    select_related_fields = []
+    prefetch_related_fields = []
+    annotations = {}
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.annotations:
+            queryset = queryset.annotate(**cls.annotations)
+
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+
+        return queryset
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -26,7 +49,10 @@ class FriendSerializer(serializers.ModelSerializer):
         model = Player
         fields = ['user']
 
-class PlayerSerializer(serializers.ModelSerializer):
+class PlayerSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['user']
+    prefetch_related_fields = [Prefetch('friends', queryset=Player.objects.select_related('user').order_by('pk'))]
+
     user = UserExSerializer(read_only=True)
     friends = FriendSerializer(many=True, read_only=True)
 
@@ -34,10 +60,30 @@ class PlayerSerializer(serializers.ModelSerializer):
         model = Player
         fields = ['user', 'friends']
 
+class LeaderboardSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['user']
+
+    username = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = Player
+        fields = ['username', 'number_of_games_played']
+
 class GameSerializer(serializers.ModelSerializer): 
     class Meta:
         model = Game
-        fields = ['game_id', 'name']
+        fields = ['game_id', 'name', 'when', 'where']
+
+class GameWriteSerializer(serializers.ModelSerializer):
+    """
+    Validates game creation and field updates, players are given as a list of usernames.
+    """
+    players = serializers.ListField(child=serializers.CharField(), max_length=500, required=False, write_only=True)
+
+    class Meta:
+        model = Game
+        fields = ['game_id', 'name', 'when', 'where', 'price', 'duration', 'private', 'players']
+        read_only_fields = ['game_id']
 
 class PlayerCompactSerializer(serializers.ModelSerializer):
     user = UserCompactSerializer(read_only=True)
@@ -46,8 +92,12 @@ class PlayerCompactSerializer(serializers.ModelSerializer):
         model = Player
         fields = ['user']
 
-class GameExSerializer(serializers.ModelSerializer):
-    num_players = serializers.SerializerMethodField() 
+class GameExSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['admin']
+    prefetch_related_fields = [Prefetch('players', queryset=Player.objects.select_related('user'))]
+    annotations = {'num_players': Count('players')}
+
+    num_players = serializers.IntegerField(read_only=True)
     admin = serializers.ReadOnlyField(source='admin.username')
     players = PlayerCompactSerializer(many=True, read_only=True)
 
@@ -55,10 +105,9 @@ class GameExSerializer(serializers.ModelSerializer):
         model = Game
         fields = ['name', 'admin', 'when', 'where', 'num_players', 'players', 'price', 'duration', 'private']
 
-    def get_num_players(self, obj):
-        return obj.players.count()
+class NotificationSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['sender__player', 'game']
 
-class NotificationSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='pk')
     sender = serializers.ReadOnlyField(source='sender.username')
     sender_href = serializers.SerializerMethodField()
@@ -72,10 +121,11 @@ class NotificationSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'notification_type', 'creation_datetime', 'read_datetime', 'read', 'sender', 'sender_href', 'game_name', 'game_href']
     
     def get_sender_href(self, obj):
-        sender_player = Player.objects.get(user=obj.sender)
-        return sender_player.get_absolute_url()
+        return obj.sender.player.get_absolute_url()
+
+class FriendshipSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['request_from__user', 'request_to__user']
 
-class FriendshipSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='pk')
     request_to = serializers.ReadOnlyField(source='request_to.user.username')
     request_from = serializers.ReadOnlyField(source='request_from.user.username')
@@ -85,7 +135,9 @@ class FriendshipSerializer(serializers.ModelSerializer):
         fields = ['id', 'request_from', 'request_to', 'request_datetime', 'action_taken_datetime', 'state']
         read_only_fields = ['id', 'request_from', 'request_to', 'request_datetime', 'action_taken_datetime', 'state']
 
-class GameParticipationRequestSerializer(serializers.ModelSerializer):
+class GameParticipationRequestSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['request_from__user', 'request_to_game']
+
     id = serializers.ReadOnlyField(source='pk')
     game_name = serializers.SerializerMethodField()
     request_from = serializers.ReadOnlyField(source='request_from.user.username')
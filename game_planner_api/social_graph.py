@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+class SocialGraph:
+    """
+    In-process adjacency index of friendships and game rosters, as compact integer arrays keyed by player id.
+    Kept up to date incrementally by the process that changes them, and rebuilt from the database once it is
+    older than settings.SOCIAL_GRAPH_MAX_AGE seconds so changes made by other processes are eventually seen.
+    Rebuilds happen in a background thread, requests keep being answered from the current indexes meanwhile.
+    """
+    def __init__(self):
+        # Guards the indexes, only ever held for in-memory work
+        self._lock = threading.Lock()
+        # One rebuild at a time
+        self._refresh_lock = threading.Lock()
+        self._built_at = None
+        # Changes made while a rebuild reads the database, replayed on its result
+        self._pending = None
+
+    def _load(self):
+        from .models import Player, Game
+
+        friends = {}
+        games = {}
+        players = {}
+        game_numbers = {}
+        next_game_number = itertools.count()
+
+        for from_player_id, to_player_id in Player.friends.through.objects.values_list('from_player_id', 'to_player_id').iterator():
+            friends.setdefault(from_player_id, array('i')).append(to_player_id)
+
+        # Game ids are strings, number them so rosters are integer arrays as well
+        for game_id, player_id in Game.players.through.objects.values_list('game_id', 'player_id').iterator():
+            if game_id not in game_numbers:
+                game_numbers[game_id] = next(next_game_number)
+
+            game_number = game_numbers[game_id]
+
+            games.setdefault(player_id, array('i')).append(game_number)
+            players.setdefault(game_number, array('i')).append(player_id)
+
+        return friends, games, players, game_numbers, next_game_number
+
+    def refresh(self):
+        """
+        Rebuilds the indexes from the database. The queries run without holding _lock, so readers
+        and incremental updates aren't blocked, and the result is swapped in at the end.
+        """
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        with self._lock:
+            self._pending = []
+
+        try:
+            indexes = self._load()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            self._friends, self._games, self._players, self._game_numbers, self._next_game_number = indexes
+            self._built_at = time.monotonic()
+
+            pending, self._pending = self._pending, None
+
+            # Changes committed after the rows were read would be lost otherwise, replaying earlier ones is harmless
+            for change, args in pending:
+                change(*args)
+
+    def _is_stale(self, max_age):
+        return self._built_at is None or (max_age is not None and time.monotonic() - self._built_at > max_age)
+
+    def _refresh_if_stale(self, max_age):
+        with self._refresh_lock:
+            # Another thread may have refreshed while this one waited
+            if self._is_stale(max_age):
+                self._refresh()
+
+    def _background_refresh(self, max_age):
+        try:
+            self._refresh_if_stale(max_age)
+        finally:
+            connections.close_all()
+
+    def _ensure_built(self):
+        max_age = getattr(settings, 'SOCIAL_GRAPH_MAX_AGE', 300)
+
+        if self._built_at is None:
+            # Nothing to answer from yet
+            self._refresh_if_stale(max_age)
+
+        elif self._is_stale(max_age) and not self._refresh_lock.locked():
+            threading.Thread(target=self._background_refresh, args=(max_age,), daemon=True).start()
+
+    def _apply(self, change, *args):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((change, args))
+
+            if self._built_at is not None:
+                change(*args)
+
+    def _mark_stale(self):
+        if self._built_at is not None:
+            self._built_at = float('-inf')
+
+    def invalidate(self):
+        """
+        Changes that can't be applied incrementally: the next use triggers a rebuild.
+        """
+        self._apply(self._mark_stale)
+
+    @staticmethod
+    def _add(index, key, value):
+        values = index.setdefault(key, array('i'))
+
+        if value not in values:
+            values.append(value)
+
+    @staticmethod
+    def _remove(index, key, value):
+        values = index.get(key)
+
+        if values is not None and value in values:
+            values.remove(value)
+
+    def _add_friendship(self, player_id, friend_id):
+        self._add(self._friends, player_id, friend_id)
+        self._add(self._friends, friend_id, player_id)
+
+    def _remove_friendship(self, player_id, friend_id):
+        self._remove(self._friends, player_id, friend_id)
+        self._remove(self._friends, friend_id, player_id)
+
+    def _add_player_to_game(self, game_id, player_id):
+        if game_id not in self._game_numbers:
+            self._game_numbers[game_id] = next(self._next_game_number)
+
+        game_number = self._game_numbers[game_id]
+
+        self._add(self._games, player_id, game_number)
+        self._add(self._players, game_number, player_id)
+
+    def _remove_player_from_game(self, game_id, player_id):
+        if game_id in self._game_numbers:
+            game_number = self._game_numbers[game_id]
+
+            self._remove(self._games, player_id, game_number)
+            self._remove(self._players, game_number, player_id)
+
+    def _remove_game(self, game_id):
+        if game_id in self._game_numbers:
+            game_number = self._game_numbers.pop(game_id)
+
+            for player_id in self._players.pop(game_number, ()):
+                self._remove(self._games, player_id, game_number)
+
+    def add_friendship(self, player_id, friend_id):
+        self._apply(self._add_friendship, player_id, friend_id)
+
+    def remove_friendship(self, player_id, friend_id):
+        self._apply(self._remove_friendship, player_id, friend_id)
+
+    def add_player_to_game(self, game_id, player_id):
+        self._apply(self._add_player_to_game, game_id, player_id)
+
+    def remove_player_from_game(self, game_id, player_id):
+        self._apply(self._remove_player_from_game, game_id, player_id)
+
+    def remove_game(self, game_id):
+        self._apply(self._remove_game, game_id)
+
+    def suggestions(self, player_id, limit):
+        """
+        Up to limit (player_id, mutual_friends, shared_games) tuples for players that aren't player_id's friends,
+        ranked by mutual friends and then by games played together.
+        """
+        self._ensure_built()
+
+        with self._lock:
+            friends = self._friends.get(player_id, array('i'))
+
+            mutual_friends = Counter()
+            for friend_id in friends:
+                mutual_friends.update(self._friends.get(friend_id, ()))
+
+            shared_games = Counter()
+            for game_number in self._games.get(player_id, ()):
+                shared_games.update(self._players.get(game_number, ()))
+
+            for excluded_id in itertools.chain(friends, [player_id]):
+                mutual_friends.pop(excluded_id, None)
+                shared_games.pop(excluded_id, None)
+
+        best = heapq.nlargest(limit, mutual_friends.keys() | shared_games.keys(),
+                              key=lambda candidate_id: (mutual_friends[candidate_id], shared_games[candidate_id], -candidate_id))
+
+        return [(candidate_id, mutual_friends[candidate_id], shared_games[candidate_id]) for candidate_id in best]
+
+_graph = None
+
+def get_social_graph():
+    global _graph
+
+    if _graph is None:
+        _graph = SocialGraph()
+
+    return _graph
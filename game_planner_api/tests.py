@@ -1,3 +1,1540 @@
-from django.test import TestCase
+import base64
+from datetime import timedelta
+import json
+import threading
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.auth.models import AnonymousUser, User
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .fast_serializers import FastPlayerSerializer, FastGameSerializer, FastNotificationSerializer, FastFriendshipSerializer, FastGameParticipationRequestSerializer
+from .models import PKGEN_EPOCH_MS, Player, Game, NotificationType, Notification, NotificationDeletion, Friendship, GameParticipationRequest, is_primary_key_violation, pkgen
+from .notification_broker import LocalBroker
+from .query_budget import QueryBudgetTestMixin, get_query_stats, sql_shape
+from .social_graph import SocialGraph
+from .versioning import version_key
+from .views import GameDetailPermission, NotificationList, PlayerList
+
+def create_player(username):
+    user = User.objects.create(username=username)
+    return Player.objects.create(user=user)
+
+class PlayerListQueryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def make_players(self, count):
+        players = [create_player('player%i' % Player.objects.count()) for i in range(count)]
+
+        for player in players:
+            player.friends.add(*[friend for friend in players if friend != player])
+
+    def test_query_count_does_not_grow_with_players_and_friends(self):
+        """
+        Listing players costs the same number of queries for 2 or 10 players with friends.
+        """
+        self.make_players(2)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/players')
+
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.make_players(8)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/players')
+
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][-1]['friends']), 7)
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        admin = create_player('admin')
+
+        now = timezone.now()
+
+        for i in range(5):
+            Game.objects.create(game_id='game%i' % i,
+                                name='Game %i' % i,
+                                admin=admin.user,
+                                when=now + timedelta(days=i),
+                                where='Lisbon',
+                                price=0,
+                                duration=timedelta(hours=1))
+
+    def test_pages_follow_next_and_previous_cursors(self):
+        response = self.client.get('/api/games', {'page_size': 2})
+
+        self.assertEqual([game['game_id'] for game in response.data['results']], ['game0', 'game1'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([game['game_id'] for game in response.data['results']], ['game2', 'game3'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([game['game_id'] for game in response.data['results']], ['game4'])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([game['game_id'] for game in response.data['results']], ['game2', 'game3'])
+
+    def test_pages_past_a_thousand_tied_rows(self):
+        player = create_player('player')
+        sender = create_player('sender')
+        now = timezone.now()
+
+        Notification.objects.bulk_create([Notification(notification_type=NotificationType.FRIEND_REQ.value, sender=sender.user,
+                                                       user=player.user, creation_datetime=now)
+                                          for _ in range(1050)])
+
+        self.client.force_authenticate(player.user)
+
+        ids = []
+        url = '/api/notifications?page_size=200'
+
+        while url is not None:
+            response = self.client.get(url)
+            ids += [notification['id'] for notification in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(len(ids), 1050)
+        self.assertEqual(ids, sorted(set(ids), reverse=True))
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([notification['id'] for notification in response.data['results']], ids[-250:-50])
+
+    def test_invalid_cursor_is_not_found(self):
+        for position in ('p=game1', 'p=tomorrow&p=game1'):
+            cursor = base64.b64encode(position.encode('ascii')).decode('ascii')
+            self.assertEqual(self.client.get('/api/games', {'cursor': cursor}).status_code, 404)
+
+class HotPathIndexTests(TestCase):
+
+    def setUp(self):
+        self.player = create_player('player')
+        self.other_player = create_player('other_player')
+
+        self.game = Game.objects.create(game_id='game',
+                                        name='Game',
+                                        admin=self.other_player.user,
+                                        when=timezone.now(),
+                                        where='Lisbon',
+                                        price=0,
+                                        duration=timedelta(hours=1))
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+
+        self.assertIn(index_name, plan)
+        self.assertNotRegex(plan, r"\bSCAN\b(?!.*\bINDEX\b)")
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+    def test_unread_notifications_lookup(self):
+        queryset = Notification.objects.filter(user=self.player.user, read=False)
+        self.assertUsesIndex(queryset, 'notif_user_read_idx')
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+    def test_request_notification_lookup(self):
+        queryset = Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
+                                               creation_datetime=timezone.now(),
+                                               user=self.player.user,
+                                               read=False)
+        self.assertUsesIndex(queryset, 'notif_source_lookup_idx')
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+    def test_active_friend_request_lookup(self):
+        queryset = Friendship.objects.filter(request_from=self.player, request_to=self.other_player, state__isnull=True)
+        self.assertUsesIndex(queryset, 'friendship_from_to_state_idx')
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+    def test_active_participation_request_lookup(self):
+        queryset = GameParticipationRequest.objects.filter(request_from=self.player, request_to_game=self.game, state__isnull=True)
+        self.assertUsesIndex(queryset, 'participation_from_game_idx')
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plans are checked on SQLite.")
+    def test_public_games_lookup(self):
+        queryset = Game.objects.filter(private=False, when__gt=timezone.now())
+        self.assertUsesIndex(queryset, 'game_private_when_idx')
+
+class NotificationSourceTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.other_player = create_player('other_player')
+
+    def test_accepting_friend_request_marks_its_notification_as_read(self):
+        self.client.force_authenticate(self.player.user)
+        self.client.post('/api/friendships', {'username': 'other_player'}, format='json')
+
+        friendship = Friendship.objects.get()
+        notification = Notification.objects.get(friendship=friendship)
+        self.assertFalse(notification.read)
+
+        self.client.force_authenticate(self.other_player.user)
+        response = self.client.patch('/api/friendships/%i' % friendship.pk, {'action': 'accept'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        notification.refresh_from_db()
+        self.assertTrue(notification.read)
+        self.assertTrue(Notification.objects.filter(friendship=friendship,
+                                                    notification_type=NotificationType.ADDED_AS_FRIEND.value,
+                                                    user=self.player.user).exists())
+
+    def test_removing_a_friend_deletes_only_that_friendships_notification(self):
+        third_player = create_player('third_player')
+
+        self.client.force_authenticate(self.player.user)
+
+        for player in (self.other_player, third_player):
+            self.client.post('/api/friendships', {'username': player.user.username}, format='json')
+
+        for friendship in Friendship.objects.all():
+            self.client.force_authenticate(friendship.request_to.user)
+            self.client.patch('/api/friendships/%i' % friendship.pk, {'action': 'accept'}, format='json')
+
+        self.client.force_authenticate(self.other_player.user)
+        response = self.client.patch('/api/players/player', {'action': 'remove_friend'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        remaining = Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value, user=self.player.user)
+        self.assertEqual([notification.sender for notification in remaining], [third_player.user])
+
+    def test_backfill_links_existing_notifications(self):
+        request_datetime = timezone.now()
+
+        friendship = Friendship.objects.create(request_from=self.player,
+                                               request_to=self.other_player,
+                                               request_datetime=request_datetime)
+        notification = Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value,
+                                                   creation_datetime=request_datetime,
+                                                   sender=self.player.user,
+                                                   user=self.other_player.user)
+
+        call_command('backfill_notification_sources', stdout=StringIO())
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.friendship, friendship)
+
+class MarkAllAsReadTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.sender = create_player('sender')
+        self.client.force_authenticate(self.player.user)
+
+        self.now = timezone.now()
+
+        for i in range(3):
+            for notification_type in [NotificationType.FRIEND_REQ, NotificationType.ADDED_AS_FRIEND]:
+                Notification.objects.create(notification_type=notification_type.value,
+                                            creation_datetime=self.now - timedelta(days=i),
+                                            sender=self.sender.user,
+                                            user=self.player.user)
+
+    def test_marks_all_unread_notifications_in_one_update(self):
+        # Users lookup, notifications UPDATE and unread counter UPDATE, inside a savepoint
+        with self.assertNumQueries(5):
+            response = self.client.patch('/api/notifications', {'action': 'mark_all_as_read'}, format='json')
+
+        self.assertEqual(response.data, {'count': 6})
+        self.assertFalse(Notification.objects.filter(read=False).exists())
+
+    def test_filters_by_type_and_before(self):
+        response = self.client.patch('/api/notifications', {'action': 'mark_all_as_read',
+                                                            'type': NotificationType.FRIEND_REQ.value,
+                                                            'before': (self.now - timedelta(hours=12)).isoformat()}, format='json')
+
+        self.assertEqual(response.data, {'count': 2})
+        self.assertEqual(Notification.objects.filter(read=False).count(), 4)
+
+    def test_invalid_before_is_rejected(self):
+        response = self.client.patch('/api/notifications', {'action': 'mark_all_as_read', 'before': 'yesterday'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+class UnreadNotificationCounterTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.sender = create_player('sender')
+        self.client.force_authenticate(self.player.user)
+
+    def create_notification(self):
+        return Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value,
+                                           creation_datetime=timezone.now(),
+                                           sender=self.sender.user,
+                                           user=self.player.user)
+
+    def get_unread_count(self):
+        response = self.client.get('/api/notifications/unread_count')
+        return response.data['unread_count']
+
+    def test_counter_follows_create_read_unread_and_delete(self):
+        notification = self.create_notification()
+        self.create_notification()
+        Notification.objects.bulk_create([Notification(notification_type=NotificationType.FRIEND_REQ.value,
+                                                        creation_datetime=timezone.now(),
+                                                        sender=self.sender.user,
+                                                        user=self.player.user)])
+        self.assertEqual(self.get_unread_count(), 3)
+
+        self.client.patch('/api/notifications/%i' % notification.pk, {'action': 'mark_as_read'}, format='json')
+        self.assertEqual(self.get_unread_count(), 2)
+
+        self.client.patch('/api/notifications/%i' % notification.pk, {'action': 'mark_as_unread'}, format='json')
+        self.assertEqual(self.get_unread_count(), 3)
+
+        Notification.objects.filter(user=self.player.user).mark_as_read()
+        self.assertEqual(self.get_unread_count(), 0)
+
+        Notification.objects.filter(pk=notification.pk).mark_as_unread()
+        self.assertEqual(self.get_unread_count(), 1)
+
+        notification.refresh_from_db()
+        notification.delete()
+        self.assertEqual(self.get_unread_count(), 0)
+
+    def test_stale_instances_do_not_skew_the_counter(self):
+        notification = self.create_notification()
+
+        Notification.objects.filter(pk=notification.pk).mark_as_read()
+        notification.delete()
+        self.assertEqual(self.get_unread_count(), 0)
+
+        notification = self.create_notification()
+        other_copy = Notification.objects.get(pk=notification.pk)
+
+        # Both copies were loaded unread, only one of the saves changes the row
+        notification.read = True
+        notification.save()
+        other_copy.read = True
+        other_copy.save()
+        self.assertEqual(self.get_unread_count(), 0)
+
+    def create_game(self, game_id, admin):
+        return Game.objects.create(game_id=game_id, name=game_id, admin=admin.user, when=timezone.now(), where='Lisbon',
+                                   price=0, duration=timedelta(hours=1))
+
+    def test_counter_follows_games_deleted_in_bulk(self):
+        for game_id in ('game0', 'game1'):
+            game = self.create_game(game_id, self.sender)
+            Notification.objects.create(notification_type=NotificationType.ADDED_TO_GAME.value, creation_datetime=timezone.now(),
+                                        sender=self.sender.user, game=game, user=self.player.user)
+
+        self.create_notification()
+        self.assertEqual(self.get_unread_count(), 3)
+
+        Game.objects.filter(game_id__in=['game0', 'game1']).delete()
+
+        self.assertEqual(self.get_unread_count(), 1)
+        self.assertEqual(NotificationDeletion.objects.filter(user=self.player.user).count(), 2)
+
+    def test_counter_follows_deletions_cascaded_from_a_user(self):
+        admin = create_player('admin')
+        game = self.create_game('game', admin)
+
+        # Sent by one deleted user, and about a game of the other
+        self.create_notification()
+        Notification.objects.create(notification_type=NotificationType.ADDED_TO_GAME.value, creation_datetime=timezone.now(),
+                                    game=game, user=self.player.user)
+        Notification.objects.create(notification_type=NotificationType.PARTICIPATION_REQ.value, creation_datetime=timezone.now(),
+                                    sender=self.player.user, game=game, user=admin.user)
+        self.assertEqual(self.get_unread_count(), 2)
+
+        self.sender.user.delete()
+        self.assertEqual(self.get_unread_count(), 1)
+
+        admin.user.delete()
+        self.assertEqual(self.get_unread_count(), 0)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(NotificationDeletion.objects.filter(user=self.player.user).count(), 2)
+
+    def test_unread_count_does_not_load_notifications(self):
+        for i in range(5):
+            self.create_notification()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_unread_count(), 5)
+
+    def test_recount_command_repairs_counter(self):
+        self.create_notification()
+        Player.objects.update(unread_notifications=42)
+
+        call_command('recount_unread_notifications', stdout=StringIO())
+
+        self.assertEqual(self.get_unread_count(), 1)
+
+class NotificationPollTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.sender = create_player('sender')
+        self.client.force_authenticate(self.player.user)
+
+    def create_notification(self):
+        return Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value,
+                                           creation_datetime=timezone.now(),
+                                           sender=self.sender.user,
+                                           user=self.player.user)
+
+    def test_poll_returns_only_changes_after_cursor(self):
+        old_notification = self.create_notification()
+
+        cursor = self.client.get('/api/notifications/poll').data['cursor']
+
+        new_notification = self.create_notification()
+
+        response = self.client.get('/api/notifications/poll', {'since': cursor, 'timeout': 0})
+        self.assertEqual([notification['id'] for notification in response.data['results']], [new_notification.pk])
+        self.assertEqual(response.data['unread_count'], 2)
+
+        cursor = response.data['cursor']
+        Notification.objects.filter(pk=old_notification.pk).mark_as_read()
+
+        response = self.client.get('/api/notifications/poll', {'since': cursor, 'timeout': 0})
+        self.assertEqual([notification['id'] for notification in response.data['results']], [old_notification.pk])
+        self.assertTrue(response.data['results'][0]['read'])
+
+        response = self.client.get('/api/notifications/poll', {'since': response.data['cursor'], 'timeout': 0})
+        self.assertEqual(response.data['results'], [])
+
+    def poll(self, cursor):
+        return self.client.get('/api/notifications/poll', {'since': cursor, 'timeout': 0}).data
+
+    def test_bulk_changes_beyond_max_results_are_delivered(self):
+        cursor = self.client.get('/api/notifications/poll').data['cursor']
+
+        Notification.objects.bulk_create([Notification(notification_type=NotificationType.FRIEND_REQ.value,
+                                                       creation_datetime=timezone.now(),
+                                                       sender=self.sender.user,
+                                                       user=self.player.user) for i in range(150)])
+        cursor = self.poll(cursor)['cursor']
+        cursor = self.poll(cursor)['cursor']
+
+        # Every row gets the same updated_at
+        Notification.objects.all().mark_as_read()
+
+        delivered = []
+
+        for i in range(3):
+            response = self.poll(cursor)
+            delivered += [notification['id'] for notification in response['results']]
+            cursor = response['cursor']
+
+        self.assertEqual(delivered, sorted(Notification.objects.values_list('pk', flat=True)))
+
+    def test_deletions_are_delivered(self):
+        notifications = [self.create_notification() for i in range(3)]
+        deleted_ids = [notifications[0].pk, notifications[1].pk]
+
+        cursor = self.client.get('/api/notifications/poll').data['cursor']
+
+        notifications[0].delete()
+        Notification.objects.filter(pk=notifications[1].pk).delete()
+
+        response = self.poll(cursor)
+
+        self.assertEqual(response['results'], [])
+        self.assertEqual(sorted(response['deleted']), deleted_ids)
+        self.assertEqual(response['unread_count'], 1)
+        self.assertEqual(self.poll(response['cursor'])['deleted'], [])
+
+    def test_local_broker_wakes_up_waiting_poll(self):
+        broker = LocalBroker()
+        version = broker.version(self.player.user.pk)
+
+        threading.Timer(0.05, broker.publish, [self.player.user.pk]).start()
+
+        self.assertTrue(broker.wait(self.player.user.pk, version, timeout=5))
+        self.assertFalse(broker.wait(self.player.user.pk, broker.version(self.player.user.pk), timeout=0.01))
+
+class NotificationFilterTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.sender = create_player('sender')
+        self.client.force_authenticate(self.player.user)
+
+        self.notifications = []
+
+        for notification_type in [NotificationType.FRIEND_REQ, NotificationType.ADDED_AS_FRIEND, NotificationType.FRIEND_REQ]:
+            self.notifications.append(Notification.objects.create(notification_type=notification_type.value,
+                                                                  creation_datetime=timezone.now(),
+                                                                  sender=self.sender.user,
+                                                                  user=self.player.user))
+
+        Notification.objects.filter(pk=self.notifications[0].pk).mark_as_read()
+
+    def get_ids(self, params):
+        response = self.client.get('/api/notifications', params)
+        return sorted(notification['id'] for notification in response.data['results'])
+
+    def test_filters(self):
+        first, second, third = [notification.pk for notification in self.notifications]
+
+        self.assertEqual(self.get_ids({'since': first}), [second, third])
+        self.assertEqual(self.get_ids({'read': 'false'}), [second, third])
+        self.assertEqual(self.get_ids({'read': 'true'}), [first])
+        self.assertEqual(self.get_ids({'type': NotificationType.FRIEND_REQ.value}), [first, third])
+        self.assertEqual(self.get_ids({'type': 'ADDED_AS_FRIEND'}), [second])
+        self.assertEqual(self.get_ids({'type': 'FRIEND_REQ', 'read': 'false'}), [third])
+
+    def test_since_timestamp_includes_changed_notifications(self):
+        since = timezone.now()
+
+        Notification.objects.filter(pk=self.notifications[1].pk).mark_as_read()
+
+        self.assertEqual(self.get_ids({'since': since.isoformat()}), [self.notifications[1].pk])
+
+    def test_invalid_filters_are_rejected(self):
+        for params in [{'since': 'yesterday'}, {'read': 'maybe'}, {'type': 'UNKNOWN'}]:
+            response = self.client.get('/api/notifications', params)
+            self.assertEqual(response.status_code, 400)
+
+class PurgeNotificationsTests(TestCase):
+
+    def setUp(self):
+        self.player = create_player('player')
+        self.sender = create_player('sender')
+
+    def create_notification(self, days_ago, read):
+        return Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value,
+                                           creation_datetime=timezone.now() - timedelta(days=days_ago),
+                                           read=read,
+                                           sender=self.sender.user,
+                                           user=self.player.user)
+
+    def test_purges_old_read_notifications_in_batches(self):
+        old_read = [self.create_notification(100, True) for i in range(5)]
+        old_unread = self.create_notification(100, False)
+        recent_read = self.create_notification(1, True)
+
+        call_command('purge_notifications', days=90, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(set(Notification.objects.values_list('pk', flat=True)), {old_unread.pk, recent_read.pk})
+        self.assertFalse(NotificationDeletion.objects.exists())
+
+    def test_purges_old_deletion_records(self):
+        NotificationDeletion.objects.create(notification_id=1, user=self.player.user, deleted_at=timezone.now() - timedelta(days=30))
+        recent = NotificationDeletion.objects.create(notification_id=2, user=self.player.user, deleted_at=timezone.now())
+
+        call_command('purge_notifications', stdout=StringIO())
+
+        self.assertEqual(list(NotificationDeletion.objects.all()), [recent])
+
+    def test_keeps_newest_read_notifications_per_user(self):
+        read = [self.create_notification(days_ago, True) for days_ago in range(1, 6)]
+        unread = self.create_notification(10, False)
+
+        call_command('purge_notifications', days=90, keep=2, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(set(Notification.objects.values_list('pk', flat=True)), {read[0].pk, read[1].pk, unread.pk})
+
+class MembershipQueryTests(TestCase):
+
+    def setUp(self):
+        self.player = create_player('player')
+        self.friends = [create_player('friend%i' % i) for i in range(20)]
+        self.stranger = create_player('stranger')
+
+        self.player.friends.add(*self.friends)
+
+        self.game = Game.objects.create(game_id='game',
+                                        name='Game',
+                                        admin=self.stranger.user,
+                                        when=timezone.now(),
+                                        where='Lisbon',
+                                        price=0,
+                                        duration=timedelta(hours=1),
+                                        private=True)
+        self.game.players.add(*self.friends)
+
+    def test_is_friend_with_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.player.is_friend_with(self.friends[-1]))
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.player.is_friend_with(self.stranger))
+
+    def test_has_player_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.game.has_player(self.friends[-1]))
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.game.has_player(self.player))
+
+    def test_private_game_permission_does_not_load_players(self):
+        request = APIRequestFactory().get('/api/games/game')
+        request.user = self.player.user
+
+        # Membership EXISTS
+        with self.assertNumQueries(1):
+            self.assertFalse(GameDetailPermission().has_object_permission(request, None, self.game))
+
+class GameVisibilityTests(TestCase):
+
+    def setUp(self):
+        self.player = create_player('player')
+        self.other_player = create_player('other_player')
+
+        games = [('public', self.other_player, False),
+                 ('private', self.other_player, True),
+                 ('administered', self.player, True),
+                 ('playing', self.other_player, True)]
+
+        for game_id, admin, private in games:
+            Game.objects.create(game_id=game_id,
+                                name=game_id,
+                                admin=admin.user,
+                                when=timezone.now(),
+                                where='Lisbon',
+                                price=0,
+                                duration=timedelta(hours=1),
+                                private=private)
+
+        Game.objects.get(game_id='playing').players.add(self.player, self.other_player)
+        Game.objects.get(game_id='public').players.add(self.player, self.other_player)
+
+    def test_visible_games(self):
+        visible = Game.objects.visible_to(self.player.user)
+
+        self.assertEqual(sorted(visible.values_list('game_id', flat=True)), ['administered', 'playing', 'public'])
+        self.assertNotIn('DISTINCT', str(visible.query))
+
+        anonymous = Game.objects.visible_to(AnonymousUser())
+        self.assertEqual(list(anonymous.values_list('game_id', flat=True)), ['public'])
+
+    def test_instance_rule_matches_queryset(self):
+        visible = set(Game.objects.visible_to(self.player.user).values_list('game_id', flat=True))
+
+        for game in Game.objects.all():
+            self.assertEqual(game.is_visible_to(self.player.user), game.game_id in visible)
+
+class GameDetailQueryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.client = APIClient()
+        self.admin = create_player('admin')
+
+        self.game = Game.objects.create(game_id='game',
+                                        name='Game',
+                                        admin=self.admin.user,
+                                        when=timezone.now(),
+                                        where='Lisbon',
+                                        price=0,
+                                        duration=timedelta(hours=1))
+
+    def test_num_players_is_annotated(self):
+        self.game.players.add(self.admin)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/games/game')
+
+        self.assertEqual(response.data['num_players'], 1)
+
+        self.game.players.add(*[create_player('player%i' % i) for i in range(5)])
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/games/game')
+
+        self.assertEqual(response.data['num_players'], 6)
+        self.assertEqual(len(response.data['players']), 6)
+
+    def test_num_players_follows_roster_changes(self):
+        create_player('player')
+        self.client.force_authenticate(self.admin.user)
+
+        response = self.client.patch('/api/games/game', {'action': 'add_player', 'username': 'player'}, format='json')
+
+        self.assertEqual(response.data['num_players'], 1)
+
+        response = self.client.patch('/api/games/game', {'action': 'remove_player', 'username': 'player'}, format='json')
+
+        self.assertEqual(response.data['num_players'], 0)
+
+class RosterBulkUpdateTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = create_player('admin')
+        self.players = [create_player('player%i' % i) for i in range(4)]
+
+        self.game = Game.objects.create(game_id='game',
+                                        name='Game',
+                                        admin=self.admin.user,
+                                        when=timezone.now(),
+                                        where='Lisbon',
+                                        price=0,
+                                        duration=timedelta(hours=1))
+        self.game.players.add(self.players[0])
+
+        self.client.force_authenticate(self.admin.user)
+
+    def roster(self):
+        return sorted(self.game.players.values_list('user__username', flat=True))
+
+    def test_add_players(self):
+        response = self.client.patch('/api/games/game', {'action': 'add_players', 'usernames': ['player0', 'player1', 'player2', 'admin']}, format='json')
+
+        self.assertEqual(response.data['num_players'], 4)
+        self.assertEqual(self.roster(), ['admin', 'player0', 'player1', 'player2'])
+
+        notified = Notification.objects.filter(notification_type=NotificationType.ADDED_TO_GAME.value, game=self.game)
+        self.assertEqual(sorted(notified.values_list('user__username', flat=True)), ['player1', 'player2'])
+
+    def test_remove_players(self):
+        self.game.players.add(self.players[1], self.players[2])
+
+        response = self.client.patch('/api/games/game', {'action': 'remove_players', 'usernames': ['player0', 'player2', 'player3']}, format='json')
+
+        self.assertEqual(response.data['num_players'], 1)
+        self.assertEqual(self.roster(), ['player1'])
+
+    def test_unknown_usernames_change_nothing(self):
+        response = self.client.patch('/api/games/game', {'action': 'add_players', 'usernames': ['player1', 'nobody']}, format='json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.roster(), ['player0'])
+
+class GameWriteTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = create_player('admin')
+        self.players = [create_player('player%i' % i) for i in range(3)]
+
+        self.client.force_authenticate(self.admin.user)
+
+        self.data = {'name': 'Game',
+                     'when': '2030-01-01T20:00:00Z',
+                     'where': 'Lisbon',
+                     'price': 5,
+                     'duration': '01:30:00',
+                     'players': ['player0', 'player1']}
+
+    def test_create(self):
+        response = self.client.post('/api/games', self.data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+
+        game = Game.objects.get(pk=response.data['game_id'])
+        self.assertEqual(game.admin, self.admin.user)
+        self.assertEqual(game.duration, timedelta(hours=1, minutes=30))
+        self.assertEqual(sorted(game.players.values_list('user__username', flat=True)), ['player0', 'player1'])
+
+        response = self.client.post('/api/games', self.data, format='json')
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_create_is_all_or_nothing(self):
+        response = self.client.post('/api/games', dict(self.data, players=['player0', 'nobody']), format='json')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Game.objects.exists())
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post('/api/games', self.data, format='json').status_code, 403)
+
+    def test_update_writes_only_given_fields(self):
+        game_id = self.client.post('/api/games', self.data, format='json').data['game_id']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/api/games/%s' % game_id, {'where': 'Porto', 'players': ['player2']}, format='json')
+
+        self.assertEqual(response.data['where'], 'Porto')
+        self.assertEqual(response.data['num_players'], 1)
+        self.assertEqual([player['user']['username'] for player in response.data['players']], ['player2'])
+
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "game_planner_api_game"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"name"', updates[0])
+
+        Game.objects.create_with_generated_id(name='Other', admin=self.admin.user, when=timezone.now(), where='Lisbon', price=0,
+                                              duration=timedelta(hours=1))
+
+        response = self.client.patch('/api/games/%s' % game_id, {'name': 'Other'}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_unchanged_name_is_not_a_conflict(self):
+        game_id = self.client.post('/api/games', self.data, format='json').data['game_id']
+
+        # Any other constraint violation is not reported as a duplicate name
+        with mock.patch.object(Game, 'update', side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            self.client.patch('/api/games/%s' % game_id, {'name': 'Game', 'where': 'Porto'}, format='json')
+
+@override_settings(API_PAYLOAD_CACHE=True)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        # Apply version bumps right away, a TestCase never commits
+        patcher = mock.patch('game_planner_api.versioning.transaction.on_commit', side_effect=lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.admin = create_player('admin')
+        self.player = create_player('player')
+
+        self.game = Game.objects.create(game_id='game',
+                                        name='Game',
+                                        admin=self.admin.user,
+                                        when=timezone.now(),
+                                        where='Lisbon',
+                                        price=0,
+                                        duration=timedelta(hours=1))
+        self.game.players.add(self.admin)
+
+    def test_repeated_get_is_served_from_cache(self):
+        response = self.client.get('/api/games/game')
+
+        # Only the lookup of the game id
+        with self.assertNumQueries(1):
+            cached_response = self.client.get('/api/games/game')
+
+        self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertIn('Last-Modified', cached_response)
+
+    def test_if_none_match_is_not_modified(self):
+        etag = self.client.get('/api/players/player')['ETag']
+
+        response = self.client.get('/api/players/player', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/api/games/game')['ETag']
+
+        self.client.force_authenticate(self.admin.user)
+        self.client.patch('/api/games/game', {'action': 'add_player', 'username': 'player'}, format='json')
+
+        response = self.client.get('/api/games/game', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['num_players'], 2)
+
+        # The new player's friends list is part of other players' payloads as well
+        etag = self.client.get('/api/players/admin')['ETag']
+        self.player.friends.add(self.admin)
+
+        self.assertNotEqual(self.client.get('/api/players/admin')['ETag'], etag)
+
+    def test_cached_private_game_is_not_served_to_outsiders(self):
+        Game.objects.filter(pk='game').update(private=True)
+
+        self.client.force_authenticate(self.admin.user)
+        self.assertEqual(self.client.get('/api/games/game').status_code, 200)
+
+        self.client.force_authenticate(self.player.user)
+        self.assertEqual(self.client.get('/api/games/game').status_code, 403)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/games/game').status_code, 403)
+
+    def test_renames_change_player_and_game_etags(self):
+        game_etag = self.client.get('/api/games/game')['ETag']
+        self.client.get('/api/players/admin')
+
+        self.admin.user.username = 'renamed'
+        self.admin.user.save()
+
+        response = self.client.get('/api/games/game')
+
+        self.assertNotEqual(response['ETag'], game_etag)
+        self.assertEqual(response.data['admin'], 'renamed')
+        self.assertEqual(self.client.get('/api/players/admin').status_code, 404)
+
+    def test_logins_change_the_player_etag(self):
+        etag = self.client.get('/api/players/player')['ETag']
+
+        self.player.user.last_login = timezone.now()
+        self.player.user.save(update_fields=['last_login'])
+
+        response = self.client.get('/api/players/player')
+
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIsNotNone(response.data['user']['last_login'])
+
+    @override_settings(API_PAYLOAD_CACHE=None)
+    def test_off_without_a_shared_cache(self):
+        self.client.get('/api/games/game')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/games/game')
+
+        self.assertNotIn('ETag', response)
+
+    def test_deleted_game_is_not_found(self):
+        self.client.get('/api/games/game')
+        self.game.delete()
+
+        self.assertEqual(self.client.get('/api/games/game').status_code, 404)
+
+    def test_unknown_objects_get_no_version(self):
+        self.assertEqual(self.client.get('/api/players/nobody').status_code, 404)
+        self.assertEqual(self.client.get('/api/games/nothing').status_code, 404)
+
+        self.assertIsNone(cache.get(version_key('player', 'nobody')))
+        self.assertIsNone(cache.get(version_key('game', 'nothing')))
+
+    @skipUnless(connection.vendor == 'mysql', "Usernames match case-insensitively with MySQL's default collation.")
+    def test_etag_follows_the_stored_username(self):
+        etag = self.client.get('/api/players/PLAYER')['ETag']
+
+        self.player.user.last_login = timezone.now()
+        self.player.user.save(update_fields=['last_login'])
+
+        self.assertNotEqual(self.client.get('/api/players/PLAYER', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+class GameIdTests(TestCase):
+
+    def setUp(self):
+        self.admin = create_player('admin')
+
+    def create_game(self, **fields):
+        return Game.objects.create_with_generated_id(**dict({'name': 'Game',
+                                                             'admin': self.admin.user,
+                                                             'when': timezone.now(),
+                                                             'where': 'Lisbon',
+                                                             'price': 0,
+                                                             'duration': timedelta(hours=1)}, **fields))
+
+    def test_ids_are_time_ordered(self):
+        # Steps of 37.5ms from the epoch, the real clock can step back
+        clock = [PKGEN_EPOCH_MS / 1000 + i * 0.0375 for i in range(1000)]
+
+        with mock.patch('game_planner_api.models.time.time', side_effect=clock):
+            ids = [pkgen() for i in range(1000)]
+
+        self.assertTrue(all(len(game_id) == 12 and game_id.isalnum() and game_id == game_id.lower() for game_id in ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual([game_id[:8] for game_id in ids], sorted(game_id[:8] for game_id in ids))
+
+    def test_collision_is_retried_with_a_new_id(self):
+        taken = self.create_game()
+
+        with mock.patch('game_planner_api.models.pkgen', side_effect=[taken.game_id, 'newgameid000']):
+            # A failed insert and a second insert, each in its own savepoint inside the create's
+            with self.assertNumQueries(9):
+                game = self.create_game(name='Other game')
+
+        self.assertEqual(game.game_id, 'newgameid000')
+
+    def test_other_integrity_errors_are_not_retried(self):
+        with mock.patch('game_planner_api.models.pkgen', side_effect=['newgameid000', 'newgameid001']) as generator:
+            with self.assertRaises(IntegrityError):
+                self.create_game(name=None)
+
+        self.assertEqual(generator.call_count, 1)
+
+    def test_primary_key_violation_is_recognized(self):
+        taken = self.create_game()
+
+        with self.assertRaises(IntegrityError) as duplicate_id, transaction.atomic():
+            Game.objects.create(game_id=taken.game_id, name='Other game', admin=self.admin.user, when=timezone.now(), where='Lisbon',
+                                price=0, duration=timedelta(hours=1))
+
+        with self.assertRaises(IntegrityError) as duplicate_name:
+            self.create_game()
+
+        self.assertTrue(is_primary_key_violation(duplicate_id.exception, Game))
+        self.assertFalse(is_primary_key_violation(duplicate_name.exception, Game))
+
+class GamesPlayedTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.players = [create_player('player%i' % i) for i in range(4)]
+
+        self.games = [Game.objects.create(game_id='game%i' % i,
+                                          name='Game %i' % i,
+                                          admin=self.players[0].user,
+                                          when=timezone.now() - timedelta(days=i - 1),
+                                          where='Lisbon',
+                                          price=0,
+                                          duration=timedelta(hours=1)) for i in range(3)]
+
+        self.games[1].players.add(*self.players[:3])
+        self.games[2].players.add(*self.players[:2])
+
+    def games_played(self):
+        return list(Player.objects.order_by('pk').values_list('number_of_games_played', flat=True))
+
+    def test_finalize_counts_past_games_once(self):
+        self.games[0].players.add(self.players[3])
+
+        call_command('finalize_games', stdout=StringIO())
+        call_command('finalize_games', stdout=StringIO())
+
+        self.assertEqual(self.games_played(), [2, 2, 1, 0])
+        self.assertFalse(Game.objects.get(pk='game0').finalized)
+
+    def test_counter_follows_changes_to_finalized_games(self):
+        for game in self.games[1:]:
+            game.finalize()
+
+        self.games[1].players.remove(self.players[2])
+        self.games[2].players.add(self.players[3])
+        self.assertEqual(self.games_played(), [2, 2, 0, 1])
+
+        self.games[2].players.clear()
+        self.assertEqual(self.games_played(), [1, 1, 0, 0])
+
+        self.games[1].delete()
+        self.assertEqual(self.games_played(), [0, 0, 0, 0])
+
+    def test_counter_follows_games_deleted_in_bulk_or_with_their_admin(self):
+        for game in self.games[1:]:
+            game.finalize()
+
+        Game.objects.filter(pk='game2').delete()
+        self.assertEqual(self.games_played(), [1, 1, 1, 0])
+
+        self.players[0].user.delete()
+        self.assertEqual(self.games_played(), [0, 0, 0])
+
+    def test_recount_command_repairs_counter(self):
+        self.games[1].finalize()
+        Player.objects.update(number_of_games_played=7)
+
+        call_command('recount_games_played', stdout=StringIO())
+
+        self.assertEqual(self.games_played(), [1, 1, 1, 0])
+
+    def test_leaderboard(self):
+        call_command('finalize_games', stdout=StringIO())
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/players/leaderboard', {'page_size': 3})
+
+        self.assertEqual([(row['username'], row['number_of_games_played']) for row in response.data['results']],
+                         [('player0', 2), ('player1', 2), ('player2', 1)])
+
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual([row['username'] for row in response.data['results']], ['player3'])
+
+    def test_leaderboard_pages_past_a_thousand_tied_players(self):
+        User.objects.bulk_create([User(username='tied%04i' % i) for i in range(1050)])
+        Player.objects.bulk_create([Player(user=user) for user in User.objects.filter(username__startswith='tied')])
+
+        usernames = []
+        url = '/api/players/leaderboard?page_size=200'
+
+        while url is not None:
+            response = self.client.get(url)
+            usernames += [row['username'] for row in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(len(usernames), 1054)
+        self.assertEqual(len(set(usernames)), 1054)
+
+class PlayerSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+        for username in ['alice', 'Alfred', 'albert', 'bob']:
+            create_player(username)
+
+    def test_prefix_search_is_capped_and_cached(self):
+        with mock.patch('game_planner_api.views.PlayerSearch.max_results', 2):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/players/search', {'q': 'AL'})
+
+            # Which two of the three matches come first depends on the database collation
+            self.assertEqual(len(response.data), 2)
+            for player in response.data:
+                self.assertTrue(player['username'].lower().startswith('al'))
+                self.assertEqual(player['id'], Player.objects.get(user__username=player['username']).pk)
+
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/players/search', {'q': 'al'})
+
+            self.assertEqual(len(response.data), 2)
+
+    def test_empty_query_is_rejected(self):
+        self.assertEqual(self.client.get('/api/players/search').status_code, 400)
+
+    def test_long_queries_are_cached_under_short_keys(self):
+        query = 'ção' * 50
+
+        with mock.patch('game_planner_api.views.cache.set') as cache_set:
+            self.assertEqual(self.client.get('/api/players/search', {'q': query}).data, [])
+
+        self.assertLessEqual(len(cache_set.call_args[0][0]), 250)
+
+class SuggestionsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.players = [create_player('player%i' % i) for i in range(6)]
+
+        # player0 - player1, player2; player1 - player3, player4; player2 - player3
+        self.players[0].friends.add(self.players[1], self.players[2])
+        self.players[1].friends.add(self.players[3], self.players[4])
+        self.players[2].friends.add(self.players[3])
+
+        game = Game.objects.create(game_id='game',
+                                   name='Game',
+                                   admin=self.players[0].user,
+                                   when=timezone.now(),
+                                   where='Lisbon',
+                                   price=0,
+                                   duration=timedelta(hours=1))
+        game.players.add(self.players[0], self.players[4], self.players[5])
+
+        patcher = mock.patch('game_planner_api.social_graph._graph', SocialGraph())
+        self.graph = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client.force_authenticate(self.players[0].user)
+
+    def get_suggestions(self):
+        response = self.client.get('/api/players/player0/suggestions')
+
+        return [(row['username'], row['mutual_friends'], row['shared_games']) for row in response.data]
+
+    def test_ranks_by_mutual_friends_then_shared_games(self):
+        self.assertEqual(self.get_suggestions(), [('player3', 2, 0), ('player4', 1, 1), ('player5', 0, 1)])
+
+    def test_incremental_updates(self):
+        self.get_suggestions()
+
+        self.graph.add_friendship(self.players[0].pk, self.players[3].pk)
+        self.graph.remove_player_from_game('game', self.players[5].pk)
+
+        self.assertEqual(self.get_suggestions(), [('player4', 1, 1)])
+
+    def test_stale_graph_is_served_while_refreshing(self):
+        self.get_suggestions()
+
+        # Written without the commit hooks, like a change made by another process
+        Player.friends.through.objects.create(from_player=self.players[0], to_player=self.players[3])
+        Player.friends.through.objects.create(from_player=self.players[3], to_player=self.players[0])
+        self.graph.invalidate()
+
+        with mock.patch('game_planner_api.social_graph.threading.Thread') as thread, self.assertNumQueries(0):
+            suggestions = self.graph.suggestions(self.players[0].pk, 10)
+
+        self.assertEqual(suggestions[0], (self.players[3].pk, 2, 0))
+        thread.assert_called_once_with(target=self.graph._background_refresh, args=(mock.ANY,), daemon=True)
+
+        self.graph.refresh()
+
+        self.assertNotIn(self.players[3].pk, [player_id for player_id, mutual_friends, shared_games in self.graph.suggestions(self.players[0].pk, 10)])
+
+    def test_changes_during_refresh_are_kept(self):
+        load = self.graph._load
+
+        def load_and_change():
+            indexes = load()
+            self.graph.add_friendship(self.players[0].pk, self.players[3].pk)
+            return indexes
+
+        with mock.patch.object(self.graph, '_load', side_effect=load_and_change):
+            self.graph.refresh()
+
+        self.assertEqual(self.get_suggestions(), [('player4', 1, 1), ('player5', 0, 1)])
+
+    def test_only_own_suggestions(self):
+        response = self.client.get('/api/players/player1/suggestions')
+
+        self.assertEqual(response.status_code, 403)
+
+class SocialGraphUpdateTests(TransactionTestCase):
+
+    def test_committed_friendship_changes_update_the_graph(self):
+        players = [create_player('player%i' % i) for i in range(3)]
+        players[1].friends.add(players[2])
+
+        graph = SocialGraph()
+
+        with mock.patch('game_planner_api.social_graph._graph', graph):
+            self.assertEqual(graph.suggestions(players[0].pk, 10), [])
+
+            players[0].friends.add(players[1])
+            self.assertEqual(graph.suggestions(players[0].pk, 10), [(players[2].pk, 1, 0)])
+
+            players[1].friends.remove(players[2])
+            self.assertEqual(graph.suggestions(players[0].pk, 10), [])
+
+class FriendshipBatchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.players = [create_player('player%i' % i) for i in range(5)]
+
+        # player0 is already a friend, player1 already sent a request
+        self.player.friends.add(self.players[0])
+        Friendship.objects.create(request_from=self.players[1], request_to=self.player, request_datetime=timezone.now())
+
+        self.client.force_authenticate(self.player.user)
+
+    def test_send(self):
+        usernames = ['player0', 'player1', 'player2', 'player3', 'player3', 'player', 'nobody']
+
+        with self.assertNumQueries(12):
+            response = self.client.post('/api/friendships/batch', {'action': 'send', 'usernames': usernames}, format='json')
+
+        self.assertEqual([(result['username'], result['status']) for result in response.data['results']],
+                         [('player0', 409), ('player1', 409), ('player2', 201), ('player3', 201), ('player', 403), ('nobody', 404)])
+
+        friendship = Friendship.objects.get(pk=response.data['results'][2]['id'])
+        self.assertEqual(friendship.request_to, self.players[2])
+        self.assertEqual(Notification.objects.get(friendship=friendship).user, self.players[2].user)
+        self.assertEqual(Player.objects.get(pk=self.players[3].pk).unread_notifications, 1)
+
+    def test_accept_and_decline(self):
+        requests = [Friendship.objects.create(request_from=player, request_to=self.player, request_datetime=timezone.now())
+                    for player in self.players[2:]]
+        outgoing = Friendship.objects.create(request_from=self.player, request_to=self.players[0], request_datetime=timezone.now())
+
+        response = self.client.post('/api/friendships/batch',
+                                    {'action': 'accept', 'ids': [requests[0].pk, requests[1].pk, outgoing.pk, 0]},
+                                    format='json')
+
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 403, 404])
+        self.assertEqual(sorted(self.player.friends.values_list('user__username', flat=True)), ['player0', 'player2', 'player3'])
+        self.assertEqual(Friendship.objects.get(pk=requests[0].pk).state, "ACTIVE")
+        self.assertEqual(Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value).count(), 2)
+
+        response = self.client.post('/api/friendships/batch', {'action': 'decline', 'ids': [requests[0].pk, requests[2].pk]}, format='json')
+
+        self.assertEqual([result['status'] for result in response.data['results']], [403, 200])
+        self.assertEqual(Friendship.objects.get(pk=requests[2].pk).state, "DECLINED")
+
+    def test_invalid_body(self):
+        response = self.client.post('/api/friendships/batch', {'action': 'send', 'usernames': 'player2'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/friendships/batch', {'action': 'accept', 'ids': [True]}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+class GameCalendarTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = create_player('player')
+        self.admin = create_player('admin')
+        self.client.force_authenticate(self.player.user)
+
+        self.now = timezone.now()
+
+        for i in range(4):
+            game = Game.objects.create(game_id='game%i' % i,
+                                       name='Game, %i' % i,
+                                       admin=self.admin.user,
+                                       when=self.now + timedelta(days=i),
+                                       where='Lisbon',
+                                       price=0,
+                                       duration=timedelta(hours=1))
+
+            if i % 2 == 0:
+                game.players.add(self.player)
+
+    def get_game_ids(self, params):
+        response = self.client.get('/api/games', params)
+        return [game['game_id'] for game in response.data['results']]
+
+    def test_time_range_and_participating_filters(self):
+        params = {'from': (self.now + timedelta(hours=12)).isoformat(),
+                  'to': (self.now + timedelta(days=3)).isoformat()}
+
+        self.assertEqual(self.get_game_ids(params), ['game1', 'game2'])
+        self.assertEqual(self.get_game_ids(dict(params, participating='true')), ['game2'])
+        self.assertEqual(self.get_game_ids({'participating': 'true'}), ['game0', 'game2'])
+
+    def test_ics_export_streams_one_event_per_game(self):
+        response = self.client.get('/api/games/calendar', {'participating': 'true'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+
+        calendar = b''.join(response.streaming_content).decode()
+
+        self.assertTrue(calendar.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertEqual(calendar.count("BEGIN:VEVENT"), 2)
+        self.assertIn("UID:game2@game-planner", calendar)
+        self.assertIn("SUMMARY:Game\\, 0", calendar)
+
+    def test_ics_export_accepts_calendar_clients(self):
+        response = self.client.get('/api/games/calendar', HTTP_ACCEPT='text/calendar')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content).decode().count("BEGIN:VEVENT"), 4)
+
+        response = self.client.get('/api/games/calendar', {'from': 'tomorrow'}, HTTP_ACCEPT='text/calendar')
+        self.assertEqual(response.status_code, 400)
+
+    def test_games_cannot_be_created_through_the_calendar(self):
+        response = self.client.post('/api/games/calendar', {'name': 'Game', 'when': self.now.isoformat(), 'where': 'Lisbon',
+                                                           'price': 0, 'duration': '01:00:00'}, format='json')
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(Game.objects.count(), 4)
+
+    def test_ics_lines_are_folded_and_escaped(self):
+        Game.objects.filter(pk='game0').update(where='Pavilhão ' * 20 + 'A\r\nB\rC')
+
+        response = self.client.get('/api/games/calendar', {'participating': 'true'})
+        calendar = b''.join(response.streaming_content)
+
+        lines = calendar.split(b'\r\n')
+
+        self.assertTrue(all(len(line) <= 75 for line in lines))
+        self.assertNotIn(b'\r', calendar.replace(b'\r\n', b''))
+
+        # Unfolding restores the escaped value
+        unfolded = calendar.decode().replace('\r\n ', '')
+        self.assertIn('LOCATION:' + 'Pavilhão ' * 20 + 'A\\nB\\nC\r\n', unfolded)
+
+class StreamingListTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.players = [create_player('player%i' % i) for i in range(5)]
+
+        for player in self.players:
+            player.friends.add(*[friend for friend in self.players if friend != player])
+
+    def read_lines(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_stream_matches_paginated_list(self):
+        paginated = self.client.get('/api/players').data['results']
+
+        response = self.client.get('/api/players', {'stream': '1'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.read_lines(response), json.loads(json.dumps(paginated)))
+
+    @mock.patch.object(PlayerList, 'stream_chunk_size', 2)
+    def test_accept_header_and_chunked_queries(self):
+        response = self.client.get('/api/players', HTTP_ACCEPT='application/x-ndjson')
+
+        # 2 queries per chunk of 2 players (players, friends with their users) and one for the empty last chunk
+        with self.assertNumQueries(2 * 3 + 1):
+            lines = self.read_lines(response)
+
+        self.assertEqual([line['user']['username'] for line in lines], ['player%i' % i for i in range(5)])
+
+    @mock.patch.object(NotificationList, 'stream_chunk_size', 2)
+    def test_stream_keeps_list_ordering(self):
+        user = self.players[0].user
+        now = timezone.now()
+
+        # Same creation time for several rows, ties are broken by descending id like the paginated list
+        for i in range(5):
+            Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value, sender=self.players[1].user, user=user,
+                                        creation_datetime=now - timedelta(minutes=i % 2))
+
+        self.client.force_authenticate(user)
+
+        paginated = self.client.get('/api/notifications').data['results']
+        streamed = self.read_lines(self.client.get('/api/notifications', {'stream': '1'}))
+
+        self.assertEqual([line['id'] for line in streamed], [notification['id'] for notification in paginated])
+
+class FastSerializerTests(TestCase):
+
+    def setUp(self):
+        self.players = [create_player('player%i' % i) for i in range(3)]
+        self.players[0].friends.add(self.players[1], self.players[2])
+
+        now = timezone.now()
+
+        self.game = Game.objects.create(game_id='game0', name='Game "0"', admin=self.players[0].user, when=now, where='Somewhere',
+                                        price=0, duration=timedelta(hours=1))
+        self.game.players.add(self.players[0])
+
+        Notification.objects.create(notification_type=NotificationType.ADDED_TO_GAME.value, sender=self.players[0].user, game=self.game,
+                                    user=self.players[1].user, creation_datetime=now - timedelta(minutes=1))
+        Notification.objects.create(notification_type=NotificationType.FRIEND_REQ.value, sender=self.players[2].user, user=self.players[1].user,
+                                    creation_datetime=now, read=True, read_datetime=now)
+
+        Friendship.objects.create(request_from=self.players[1], request_to=self.players[2], request_datetime=now, state="PENDING")
+        GameParticipationRequest.objects.create(request_from=self.players[2], request_to_game=self.game, request_datetime=now, state="PENDING")
+
+    def assertRendersIdentically(self, fast_serializer_class, queryset):
+        serializer_class = fast_serializer_class.serializer_class
+
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            instances = serializer_class.setup_eager_loading(queryset)
+        else:
+            instances = queryset
+
+        fast_serializer = fast_serializer_class()
+
+        expected = JSONRenderer().render(serializer_class(instances, many=True).data)
+        actual = JSONRenderer().render(fast_serializer.serialize(fast_serializer.values(queryset)))
+
+        self.assertEqual(actual, expected)
+
+    def test_output_is_byte_identical(self):
+        self.assertRendersIdentically(FastPlayerSerializer, Player.objects.order_by('pk'))
+        self.assertRendersIdentically(FastGameSerializer, Game.objects.order_by('pk'))
+        self.assertRendersIdentically(FastNotificationSerializer, Notification.objects.order_by('pk'))
+        self.assertRendersIdentically(FastFriendshipSerializer, Friendship.objects.order_by('pk'))
+        self.assertRendersIdentically(FastGameParticipationRequestSerializer, GameParticipationRequest.objects.order_by('pk'))
+
+    def test_list_pages_through_values(self):
+        client = APIClient()
+        client.force_authenticate(self.players[1].user)
+
+        response = client.get('/api/notifications', {'page_size': 1})
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotIn('game_name', response.data['results'][0])
+
+        response = client.get(response.data['next'])
+
+        self.assertEqual(response.data['results'][0]['game_name'], 'Game "0"')
+        self.assertIsNone(response.data['next'])
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.client = APIClient()
+        self.players = [create_player('player%i' % i) for i in range(6)]
+        self.player = self.players[0]
+
+        self.player.friends.add(*self.players[1:3])
+
+        now = timezone.now()
+
+        for i, admin in enumerate(self.players):
+            game = Game.objects.create(game_id='game%i' % i, name='Game %i' % i, admin=admin.user, when=now, where='Lisbon',
+                                       price=0, duration=timedelta(hours=1))
+            game.players.add(*self.players)
+
+        for sender in self.players[1:]:
+            Notification.objects.create(notification_type=NotificationType.ADDED_TO_GAME.value, sender=sender.user, game_id='game1',
+                                        user=self.player.user, creation_datetime=now)
+            Friendship.objects.create(request_from=sender, request_to=self.player, request_datetime=now)
+            GameParticipationRequest.objects.create(request_from=sender, request_to_game_id='game0', request_datetime=now)
+
+        self.client.force_authenticate(self.player.user)
+
+    def test_views_stay_within_budget(self):
+        notification = Notification.objects.first()
+        friendship = Friendship.objects.first()
+        participation_request = GameParticipationRequest.objects.first()
+
+        budgets = [('/api/players', 2),
+                   ('/api/players/leaderboard', 1),
+                   ('/api/players/player0', 3),
+                   ('/api/games', 1),
+                   ('/api/games/game0', 2),
+                   ('/api/notifications', 1),
+                   ('/api/notifications/%i' % notification.pk, 1),
+                   ('/api/friendships', 2),
+                   ('/api/friendships/%i' % friendship.pk, 1),
+                   ('/api/game_participation_requests', 2),
+                   ('/api/game_participation_requests/%i' % participation_request.pk, 1)]
+
+        for url, max_queries in budgets:
+            with self.subTest(url=url), self.assertQueryBudget(max_queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_writes_stay_within_budget(self):
+        notification = Notification.objects.first()
+        friendship = Friendship.objects.first()
+        participation_request = GameParticipationRequest.objects.first()
+
+        # players.add() checks for rows already in the roster again after update_roster() does
+        budgets = [('/api/notifications/%i' % notification.pk, {'action': 'mark_as_read'}, 6, 1),
+                   ('/api/friendships/%i' % friendship.pk, {'action': 'accept'}, 11, 1),
+                   ('/api/game_participation_requests/%i' % participation_request.pk, {'action': 'decline'}, 5, 1),
+                   ('/api/games/game0', {'action': 'remove_player', 'username': 'player5'}, 7, 1),
+                   ('/api/games/game0', {'action': 'add_players', 'usernames': ['player5']}, 13, 2),
+                   ('/api/games/game0', {'where': 'Porto'}, 6, 1)]
+
+        for url, data, max_queries, max_repeats in budgets:
+            with self.subTest(url=url, data=data), self.assertQueryBudget(max_queries, max_repeats):
+                self.assertEqual(self.client.patch(url, data, format='json').status_code, 200)
+
+    def test_per_row_queries_are_caught(self):
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(10):
+                [player.user.username for player in Player.objects.all()]
+
+        self.assertEqual(sql_shape('SELECT 1 WHERE id IN (%s, %s, %s) AND x = %s'), sql_shape('SELECT 1 WHERE id IN (%s) AND x = %s'))
+
+    def test_middleware_reports_queries_per_view(self):
+        get_query_stats().reset()
+
+        with self.modify_settings(MIDDLEWARE={'append': 'game_planner_api.query_budget.QueryBudgetMiddleware'}), \
+                self.settings(QUERY_BUDGET_HEADERS=True):
+            response = self.client.get('/api/players/player0')
+
+            with self.assertLogs('game_planner_api.query_budget', 'WARNING'):
+                with mock.patch('game_planner_api.serializers.GameExSerializer.prefetch_related_fields', []):
+                    self.client.get('/api/games/game0')
+
+        self.assertEqual(response['X-Query-Count'], '3')
+        self.assertEqual(response['X-Query-Repeated'], '1')
+
+        self.player.user.is_staff = True
+        self.player.user.save()
+
+        stats = self.client.get('/api/query_stats').data
+
+        self.assertEqual(stats['player-detail']['max_queries'], 3)
+        self.assertFalse(stats['player-detail']['repeated_shapes'])
+        self.assertTrue(stats['game-detail']['repeated_shapes'])
+
+        self.client.force_authenticate(self.players[1].user)
+        self.assertEqual(self.client.get('/api/query_stats').status_code, 403)
+
+    @mock.patch.object(PlayerList, 'stream_chunk_size', 2)
+    def test_middleware_counts_queries_of_streamed_lists(self):
+        get_query_stats().reset()
+
+        with self.modify_settings(MIDDLEWARE={'append': 'game_planner_api.query_budget.QueryBudgetMiddleware'}):
+            response = self.client.get('/api/players', {'stream': '1'})
+
+            self.assertNotIn('X-Query-Count', response)
+            self.assertNotIn('game_planner_api.views.PlayerList', get_query_stats().snapshot())
+
+            b''.join(response.streaming_content)
+
+        stats = get_query_stats().snapshot()['game_planner_api.views.PlayerList']
+
+        # Three chunks of players with their friends, and the empty last chunk
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['queries'], 7)
+        # Every chunk runs the same queries, that is not an N+1
+        self.assertFalse(stats['repeated_shapes'])
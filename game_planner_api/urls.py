@@ -4,20 +4,29 @@ from game_planner_api import views
 
 urlpatterns = [
     path('players', views.PlayerList.as_view()),
+    path('players/leaderboard', views.PlayerLeaderboard.as_view()),
+    path('players/search', views.PlayerSearch.as_view()),
     path('players/<str:username>', views.PlayerDetail.as_view(), name='player-detail'),
+    path('players/<str:username>/suggestions', views.PlayerSuggestions.as_view()),
 
     path('games', views.GameList.as_view()),
+    path('games/calendar', views.GameCalendar.as_view()),
     path('games/<str:game_id>', views.GameDetail.as_view(), name='game-detail'),
 
     path('notifications', views.NotificationList.as_view()),
+    path('notifications/unread_count', views.NotificationUnreadCount.as_view()),
+    path('notifications/poll', views.NotificationPoll.as_view()),
     path('notifications/<int:id>', views.NotificationDetail.as_view()),
 
     path('friendships', views.FriendshipList.as_view()),
+    path('friendships/batch', views.FriendshipBatch.as_view()),
     path('friendships/<int:id>', views.FriendshipDetail.as_view()),
 
     path('game_participation_requests', views.GameParticipationRequestList.as_view()),
     path('game_participation_requests/<int:id>', views.GameParticipationRequestDetail.as_view()),
 
+    path('query_stats', views.QueryStats.as_view()),
+
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+def payload_cache_enabled():
+    """
+    Versions have to be seen by every process that serves or writes the objects, settings.API_PAYLOAD_CACHE
+    defaults to whether the default cache is shared between processes (not the per-process LocMemCache).
+    """
+    enabled = getattr(settings, 'API_PAYLOAD_CACHE', None)
+
+    if enabled is None:
+        enabled = not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+    return enabled
+
+def version_key(kind, key):
+    return 'version:%s:%s' % (kind, key)
+
+def get_version(kind, key):
+    """
+    Timestamp of the last committed write to the object, used for its ETag and Last-Modified.
+    An object without a stored version (never written since the cache started, or evicted) gets one now.
+    """
+    return cache.get_or_set(version_key(kind, key), time.time, None)
+
+def bump_versions(kind, keys):
+    """
+    Gives the objects a new version once the current transaction commits, so cached payloads and ETags
+    of the old versions stop being used. Bumping before the commit could let a reader cache the old state
+    under the new version. keys may be a lazy queryset, it isn't evaluated while payload caching is off.
+    """
+    if not payload_cache_enabled():
+        return
+
+    keys = list(keys)
+
+    if not keys:
+        return
+
+    def bump():
+        version = time.time()
+        cache.set_many({version_key(kind, key): version for key in keys}, None)
+
+    transaction.on_commit(bump)
@@ -1,18 +1,284 @@
+import hashlib
 import re
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework import exceptions
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.timezone import utc
+from django.utils.dateparse import parse_datetime
+
+from game_planner_api.pagination import keyset_after, PlayerPagination, LeaderboardPagination, GamePagination, NotificationPagination, FriendshipPagination, GameParticipationRequestPagination
+from game_planner_api.serializers import PlayerSerializer, LeaderboardSerializer, GameSerializer, GameExSerializer, GameWriteSerializer, NotificationSerializer, FriendshipSerializer, GameParticipationRequestSerializer
+from game_planner_api.fast_serializers import FastPlayerSerializer, FastGameSerializer, FastNotificationSerializer, FastFriendshipSerializer, FastGameParticipationRequestSerializer
+from .models import Player, Game, NotificationType, Notification, NotificationDeletion, Friendship, GameParticipationRequest
+from .notification_broker import get_broker
+from .social_graph import get_social_graph
+from .query_budget import get_query_stats
+from .renderers import ICalendarRenderer, NDJSONRenderer, ndjson_line
+from .versioning import get_version, payload_cache_enabled
+
+class EagerLoadingViewMixin:
+    """
+    Applies the serializer's declared select_related/prefetch_related needs to the view queryset.
+    """
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        serializer_class = self.get_serializer_class()
+
+        if queryset is not None and hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(queryset)
+
+        return queryset
+
+class StreamingListMixin:
+    """
+    Opt-in streaming of list responses as newline delimited JSON, with ?stream=1 or Accept: application/x-ndjson.
+    Rows come in the same order as the paginated list, read in keyset chunks and serialized a chunk at a time,
+    so memory stays bounded regardless of result size.
+    """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        if not (request.query_params.get('stream', None) == '1' or request.accepted_renderer.format == 'ndjson'):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        return StreamingHttpResponse(self.stream_rows(queryset), content_type=NDJSONRenderer.media_type)
+
+    def get_stream_ordering(self, queryset):
+        ordering = list(getattr(self.paginator, 'ordering', None) or ['pk'])
+
+        # Keyset chunks need a unique last field
+        if ordering[-1].lstrip('-') not in ('pk', queryset.model._meta.pk.name):
+            ordering.append('pk')
+
+        return ordering
+
+    def stream_rows(self, queryset):
+        ordering = self.get_stream_ordering(queryset)
+        queryset = queryset.order_by(*ordering)
+        last = None
+
+        while True:
+            # Keyset chunks instead of queryset.iterator(): the MySQL driver buffers a whole result set client side,
+            # and each chunk still gets the serializer's prefetch_related applied
+            chunk_queryset = queryset if last is None else queryset.filter(keyset_after(ordering, last))
+            chunk = list(chunk_queryset[:self.stream_chunk_size])
+
+            if not chunk:
+                return
+
+            for data in self.get_serializer(chunk, many=True).data:
+                yield ndjson_line(data)
+
+            last = chunk[-1]
+
+class FastListMixin:
+    """
+    Serves list pages with fast_serializer_class, from a .values() projection instead of model instances.
+    The output is the same as serializer_class would produce.
+    """
+    fast_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        fast_serializer = self.fast_serializer_class()
+
+        # Cursors are built from the ordering fields of the rows at the page edges, so the projection must include them
+        ordering_fields = [field.lstrip('-') for field in getattr(self.paginator, 'ordering', ())]
+        rows = fast_serializer.values(queryset, ordering_fields)
+
+        page = self.paginate_queryset(rows)
+
+        if page is not None:
+            return self.get_paginated_response(fast_serializer.serialize(page))
+
+        return Response(fast_serializer.serialize(rows))
+
+class CachedRetrieveMixin:
+    """
+    GET of a single object served from a cache of its serialized payload, keyed by the object's version
+    (see versioning.py, bumped on every committed write), with ETag/Last-Modified and 304 Not Modified answers
+    to conditional requests. Permissions are checked before anything is answered from the cache.
+    A plain uncached GET unless payload_cache_enabled(), i.e. the cache is shared by every process.
+    """
+    version_kind = None
+    # Field of the URL lookup, read back as stored: the model receivers bump versions of the stored value,
+    # which a case-insensitive collation can match with another spelling
+    version_field = None
+
+    def get_version_key(self):
+        """
+        The requested object's value of version_field, from a single indexed query.
+        Unknown objects raise NotFound, no version is created for them.
+        """
+        value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+
+        key = self.queryset.filter(**{self.version_field: value}).values_list(self.version_field, flat=True).first()
+
+        if key is None:
+            raise exceptions.NotFound()
+
+        return key
+
+    def get_cache_entry(self, instance):
+        return {'data': self.get_serializer(instance).data}
+
+    def has_cached_object_permission(self, request, entry):
+        return True
+
+    def retrieve(self, request, *args, **kwargs):
+        if not payload_cache_enabled():
+            return super().retrieve(request, *args, **kwargs)
+
+        key = self.get_version_key()
+
+        # Read before the object so a concurrent write can only make the cached payload newer than its version
+        version = get_version(self.version_kind, key)
+        cache_key = 'payload:%s:%s:%r' % (self.version_kind, key, version)
+
+        entry = cache.get(cache_key)
+
+        if entry is None or not self.has_cached_object_permission(request, entry):
+            # Raises NotFound/PermissionDenied like an uncached GET
+            entry = self.get_cache_entry(self.get_object())
+            cache.set(cache_key, entry, getattr(settings, 'API_PAYLOAD_CACHE_TIMEOUT', 300))
+
+        etag = '"%s-%s-%r"' % (self.version_kind, key, version)
+        last_modified = int(version)
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+            response = Response(entry['data'])
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+def parse_timestamp(value, parameter_name):
+    """
+    Parses an ISO 8601 request parameter into an aware datetime, raising ParseError if it isn't one.
+    """
+    try:
+        timestamp = parse_datetime(str(value))
+    except ValueError:
+        timestamp = None
+
+    if timestamp is None:
+        raise exceptions.ParseError(detail="'%s' must be an ISO 8601 timestamp." % parameter_name)
+
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+
+    return timestamp
+
+def parse_notification_type(value):
+    """
+    Accepts a NotificationType value or name, raising ParseError for anything else.
+    """
+    if isinstance(value, str) and value in NotificationType.__members__:
+        return NotificationType[value]
+
+    try:
+        return NotificationType(int(value))
+    except (TypeError, ValueError):
+        raise exceptions.ParseError(detail="'type' must be a valid notification type.")
+
+def parse_poll_cursor(value):
+    """
+    (timestamp, id) from a notification poll cursor 'timestamp,id', or a bare ISO 8601 timestamp with a None id.
+    """
+    timestamp, separator, last_id = str(value).partition(',')
+
+    try:
+        last_id = int(last_id) if separator else None
+    except ValueError:
+        raise exceptions.ParseError(detail="'since' must be a poll cursor or an ISO 8601 timestamp.")
+
+    return parse_timestamp(timestamp, 'since'), last_id
+
+def escape_ical_text(value):
+    value = value.replace('\r\n', '\n').replace('\r', '\n')
+
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ical_content_line(name, value):
+    """
+    'NAME:value' ending in CRLF, folded so no line is longer than 75 octets (RFC 5545 3.1).
+    Continuation lines start with a space, and multi-byte characters are never split.
+    """
+    lines = []
+    line = ''
+    line_octets = 0
+
+    for char in '%s:%s' % (name, value):
+        char_octets = len(char.encode('utf-8'))
+
+        if line_octets + char_octets > 75:
+            lines.append(line)
+            line = ' '
+            line_octets = 1
 
-from game_planner_api.serializers import PlayerSerializer, GameSerializer, GameExSerializer, NotificationSerializer, FriendshipSerializer, GameParticipationRequestSerializer
-from .models import Player, Game, NotificationType, Notification, Friendship, GameParticipationRequest
+        line += char
+        line_octets += char_octets
+
+    lines.append(line)
+
+    return '\r\n'.join(lines) + '\r\n'
+
+def get_unread_count(user):
+    unread_count = Player.objects.filter(user=user).values_list('unread_notifications', flat=True).first()
+
+    return unread_count or 0
+
+def resolve_players(usernames):
+    """
+    Player ids of usernames in one query, raising NotFound listing any unknown username.
+    """
+    players = dict(Player.objects.filter(user__username__in=usernames).values_list('user__username', 'pk'))
+
+    missing = [username for username in OrderedDict.fromkeys(usernames) if username not in players]
+
+    if missing:
+        raise exceptions.NotFound(detail="Players not found: %s." % ", ".join(missing))
+
+    return list(players.values())
+
+@contextmanager
+def duplicate_game_name_as_conflict(admin, name):
+    """
+    Turns a violation of the (admin, name) unique constraint, by a write racing the name_taken() check, into a Conflict.
+    """
+    try:
+        yield
+    except IntegrityError:
+        if name is None or not Game.objects.name_taken(admin, name):
+            raise
+
+        raise Conflict(detail=Game.DUPLICATE_NAME_MESSAGE)
 
 class IndirectModelMixin:
 
@@ -46,16 +312,91 @@ class IndirectModelMixin:
 
         return obj
 
-class PlayerList(generics.ListAPIView):
+class PlayerList(StreamingListMixin, FastListMixin, EagerLoadingViewMixin, generics.ListAPIView):
     queryset = Player.objects.all()
     serializer_class = PlayerSerializer
+    fast_serializer_class = FastPlayerSerializer
+    pagination_class = PlayerPagination
+
+class PlayerLeaderboard(EagerLoadingViewMixin, generics.ListAPIView):
+    """
+    Players ranked by number_of_games_played, read in index order from the denormalized counter.
+    """
+    queryset = Player.objects.all()
+    serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+
+class PlayerSearch(generics.GenericAPIView):
+    """
+    Autocomplete for player pickers: players whose username starts with 'q', case insensitive, in username order.
+    The prefix is matched with LIKE 'q%' on the unique username index and recent answers are cached.
+    """
+    max_results = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+
+        if not query or len(query) > 150:
+            raise exceptions.ParseError(detail="'q' must be between 1 and 150 characters long.")
+
+        # Memcached keys are at most 250 characters, a hash keeps any query within that
+        cache_key = 'player_search:%s' % hashlib.md5(query.lower().encode()).hexdigest()
+
+        results = cache.get(cache_key)
+
+        if results is None:
+            players = Player.objects.filter(user__username__istartswith=query) \
+                                    .order_by('user__username') \
+                                    .values_list('pk', 'user__username')[:self.max_results]
+
+            results = [{'id': player_id, 'username': username} for player_id, username in players]
+
+            cache.set(cache_key, results, getattr(settings, 'PLAYER_SEARCH_CACHE_TIMEOUT', 60))
+
+        return Response(results)
+
+class PlayerSuggestions(generics.GenericAPIView):
+    """
+    Players {username} may know: non-friends ranked by mutual friends, then by games played together.
+    Answered from the in-process social graph, only usernames are read from the database.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        if request.user.username != self.kwargs['username']:
+            raise exceptions.PermissionDenied()
+
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise exceptions.ParseError(detail="'limit' must be an integer.")
 
-class PlayerDetail(IndirectModelMixin,
+        player_id = Player.objects.filter(user=request.user).values_list('pk', flat=True).first()
+
+        suggestions = get_social_graph().suggestions(player_id, max(limit, 0))
+
+        usernames = dict(Player.objects.filter(pk__in=[candidate_id for candidate_id, mutual_friends, shared_games in suggestions])
+                                       .values_list('pk', 'user__username'))
+
+        return Response([{'username': usernames[candidate_id],
+                          'mutual_friends': mutual_friends,
+                          'shared_games': shared_games} for candidate_id, mutual_friends, shared_games in suggestions
+                                                        if candidate_id in usernames])
+
+class PlayerDetail(CachedRetrieveMixin,
+                   EagerLoadingViewMixin,
+                   IndirectModelMixin,
                    generics.RetrieveUpdateAPIView):
     lookup_field = 'username'
     indirect_lookup_field = 'user'
     indirect_model = User
 
+    version_kind = 'player'
+    version_field = 'user__username'
+
     queryset = Player.objects.all()
     serializer_class = PlayerSerializer
 
@@ -76,25 +417,27 @@ class PlayerDetail(IndirectModelMixin,
 
             player_to_remove = Player.objects.get(user=user_to_remove)
 
-            are_friends = player_to_remove in requester_player.friends.all()
+            are_friends = requester_player.is_friend_with(player_to_remove)
 
             if not are_friends:
                 raise exceptions.NotFound(detail="You are not %s's friend." % self.kwargs['username'])
 
             requester_player.friends.remove(player_to_remove)
 
-            # Remove "X accepted your friend request." notification from the requester if it hasn't been read yet
-            notification = Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value,
-                                                        user=player_to_remove.user,
-                                                        read=False)
-            
-            if notification:
-                notification.delete()
+            friendship = Friendship.objects.filter(Q(request_from=requester_player, request_to=player_to_remove) |
+                                                   Q(request_from=player_to_remove, request_to=requester_player),
+                                                   state="ACTIVE").first()
+
+            # Remove "X accepted your friend request." notification of this friendship if it hasn't been read yet
+            if friendship is not None:
+                Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value,
+                                            friendship=friendship,
+                                            read=False).delete()
 
             serializer.save()
         
         # Authenticated player updates his info
-        if 'action' in request_json and request_json['action'] == "update_player":
+        elif 'action' in request_json and request_json['action'] == "update_player":
 
             user_to_update = User.objects.get(username=self.kwargs['username'])
 
@@ -124,27 +467,99 @@ class PlayerDetail(IndirectModelMixin,
         else:
             raise exceptions.ParseError()
 
-class GameList(generics.ListAPIView):
+class GameList(StreamingListMixin, FastListMixin, EagerLoadingViewMixin, generics.ListCreateAPIView):
     queryset = Game.objects.all()
     serializer_class = GameSerializer
+    fast_serializer_class = FastGameSerializer
+    pagination_class = GamePagination
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    # Only the columns the compact game representation needs
+    projection = ['game_id', 'name', 'when', 'where']
 
     def get_queryset(self):
         """
         Excludes games that user does not have permission to see.
+        Optionally restricted to games between 'from' and 'to' and to games user is 'participating' in.
         """
         qs = super().get_queryset()
 
-        filter_q = Q(private=False)
-        
-        if self.request.user and self.request.user.is_authenticated:
-            user = self.request.user
+        qs = qs.visible_to(self.request.user)
 
-            # Get player's games list
-            player = Player.objects.get(user=user)
+        if 'from' in self.request.query_params:
+            qs = qs.filter(when__gte=parse_timestamp(self.request.query_params['from'], 'from'))
 
-            filter_q = filter_q | Q(admin=user) | Q(players=player)
-        
-        return qs.filter(filter_q).distinct()
+        if 'to' in self.request.query_params:
+            qs = qs.filter(when__lt=parse_timestamp(self.request.query_params['to'], 'to'))
+
+        if self.request.query_params.get('participating', None) == 'true':
+            if not self.request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+
+            player = Player.objects.get(user=self.request.user)
+
+            qs = qs.with_player(player)
+
+        return qs.only(*self.projection)
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return GameWriteSerializer
+
+        return super().get_serializer_class()
+
+    def perform_create(self, serializer):
+        """
+        Inserts the game and its roster in one transaction, administered by the authenticated user.
+        """
+        fields = dict(serializer.validated_data)
+        players = resolve_players(fields.pop('players', []))
+
+        if Game.objects.name_taken(self.request.user, fields['name']):
+            raise Conflict(detail=Game.DUPLICATE_NAME_MESSAGE)
+
+        with duplicate_game_name_as_conflict(self.request.user, fields['name']):
+            serializer.instance = Game.objects.create_with_generated_id(admin=self.request.user, players=players, **fields)
+
+class GameCalendar(GameList):
+    # Read only, games are created through GameList
+    http_method_names = ['get', 'head', 'options']
+
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ICalendarRenderer]
+
+    projection = ['game_id', 'name', 'when', 'where', 'duration']
+
+    def list(self, request, *args, **kwargs):
+        """
+        Same games as GameList, streamed as an iCalendar (.ics) file one event at a time.
+        """
+        games = self.get_queryset().order_by('when', 'game_id')
+
+        response = StreamingHttpResponse(self.stream_calendar(games), content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="games.ics"'
+
+        return response
+
+    def stream_calendar(self, games):
+        timestamp_format = '%Y%m%dT%H%M%SZ'
+        dtstamp = timezone.now().astimezone(utc).strftime(timestamp_format)
+
+        yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Game Planner//Games//EN\r\n"
+
+        for game in games.iterator():
+            start = game.when.astimezone(utc)
+
+            yield ''.join([ical_content_line('BEGIN', 'VEVENT'),
+                           ical_content_line('UID', '%s@game-planner' % game.game_id),
+                           ical_content_line('DTSTAMP', dtstamp),
+                           ical_content_line('DTSTART', start.strftime(timestamp_format)),
+                           ical_content_line('DTEND', (start + game.duration).strftime(timestamp_format)),
+                           ical_content_line('SUMMARY', escape_ical_text(game.name)),
+                           ical_content_line('LOCATION', escape_ical_text(game.where)),
+                           ical_content_line('URL', self.request.build_absolute_uri(game.get_absolute_url())),
+                           ical_content_line('END', 'VEVENT')])
+
+        yield "END:VCALENDAR\r\n"
 
 class GameDetailPermission(permissions.BasePermission):
     
@@ -156,22 +571,12 @@ class GameDetailPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
 
         if request.method in permissions.SAFE_METHODS:
-
-            authorized = not obj.private
-
-            if request.user and request.user.is_authenticated:
-                player = Player.objects.get(user=request.user)
-                is_admin = (request.user == obj.admin)
-                participating = (player in obj.players.all())
-
-                authorized = authorized or is_admin or participating
-
-            return authorized
+            return obj.is_visible_to(request.user)
 
         # admin user can use non safe methods
-        return obj.admin == request.user
+        return obj.admin_id == request.user.pk
 
-class GameDetail(generics.RetrieveUpdateDestroyAPIView):
+class GameDetail(CachedRetrieveMixin, EagerLoadingViewMixin, generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'game_id'
 
     queryset = Game.objects.all()
@@ -179,67 +584,304 @@ class GameDetail(generics.RetrieveUpdateDestroyAPIView):
 
     permission_classes = [GameDetailPermission]
 
+    version_kind = 'game'
+    version_field = 'game_id'
+
+    def get_cache_entry(self, instance):
+        entry = super().get_cache_entry(instance)
+
+        # Enough to apply GameDetailPermission to later cached GETs
+        entry.update(private=instance.private, admin_id=instance.admin_id)
+
+        return entry
+
+    def has_cached_object_permission(self, request, entry):
+        game = Game(game_id=self.kwargs['game_id'], private=entry['private'], admin_id=entry['admin_id'])
+
+        return game.is_visible_to(request.user)
+
+    def get_queryset(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return super().get_queryset()
+
+        # Writes only need the game itself, perform_update() loads the response's roster once it has changed
+        return self.queryset.all()
+
+    max_roster_changes = 500
+
     # override parent class put method so that HTTP PUT request returns 405 Method not allowed
     def put(self, request, *args, **kwargs):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     def perform_update(self, serializer):
-        game = Game.objects.get(game_id=self.kwargs['game_id'])
+        game = serializer.instance
 
         if 'action' in self.request.data and self.request.data['action'] == 'add_player' and 'username' in self.request.data:
 
-            user_to_add = User.objects.filter(username=self.request.data['username'])
+            player_to_add = Player.objects.filter(user__username=self.request.data['username']).first()
 
-            if not user_to_add:
+            if player_to_add is None:
                 raise exceptions.NotFound(detail="Player '%s' not found." % self.request.data['username'])
 
-            player_to_add = Player.objects.get(user=user_to_add[0])
-
-            if player_to_add in game.players.all():
+            if game.has_player(player_to_add):
                 raise Conflict(detail="'%s' is already participating in '%s'." % (self.request.data['username'], game.name))
 
             game.players.add(player_to_add)
     
         elif 'action' in self.request.data and self.request.data['action'] == 'remove_player' and 'username' in self.request.data:
 
-            user_to_remove = User.objects.filter(username=self.request.data['username'])
+            player_to_remove = Player.objects.filter(user__username=self.request.data['username']).first()
 
-            if not user_to_remove:
+            if player_to_remove is None:
                 raise exceptions.NotFound(detail="Player '%s' not found." % self.request.data['username'])
 
-            player_to_remove = Player.objects.get(user=user_to_remove[0])
-
-            if not player_to_remove in game.players.all():
+            if not game.has_player(player_to_remove):
                 raise Conflict(detail="'%s' is not participating in '%s'." % (self.request.data['username'], game.name))
 
             game.players.remove(player_to_remove)
 
+        elif 'action' in self.request.data and self.request.data['action'] in ('add_players', 'remove_players') and 'usernames' in self.request.data:
+
+            self.update_roster(game, self.request.data['usernames'], add=(self.request.data['action'] == 'add_players'))
+
+        elif not 'action' in self.request.data:
+
+            self.update_game(game)
+
         else:
             raise exceptions.ParseError()
 
-class NotificationList(generics.ListAPIView):
+        serializer.instance = GameExSerializer.setup_eager_loading(Game.objects.all()).get(pk=game.pk)
+
+    def update_game(self, game):
+        """
+        Field updates: only the given fields are written, along with the roster if 'players' is given, in one transaction.
+        """
+        write_serializer = GameWriteSerializer(game, data=self.request.data, partial=True)
+        write_serializer.is_valid(raise_exception=True)
+
+        fields = dict(write_serializer.validated_data)
+
+        if not fields:
+            raise exceptions.ParseError()
+
+        players = resolve_players(fields.pop('players')) if 'players' in fields else None
+
+        # Keeping the current name can't violate the constraint, and name_taken() would match the game itself
+        new_name = fields['name'] if fields.get('name', game.name) != game.name else None
+
+        if new_name is not None and Game.objects.name_taken(game.admin_id, new_name):
+            raise Conflict(detail=Game.DUPLICATE_NAME_MESSAGE)
+
+        with duplicate_game_name_as_conflict(game.admin_id, new_name):
+            game.update(players=players, **fields)
+
+    def update_roster(self, game, usernames, add):
+        """
+        Adds or removes many players at once. Usernames are resolved in one query and diffed against the roster in another,
+        players already in (add) or not in (remove) the roster are left as they are.
+        Added players are notified with a single bulk insert.
+        """
+        if not isinstance(usernames, list) or not all(isinstance(username, str) for username in usernames) or len(usernames) > self.max_roster_changes:
+            raise exceptions.ParseError(detail="'usernames' must be a list of at most %i usernames." % self.max_roster_changes)
+
+        players = OrderedDict((username, (player_id, user_id)) for username, player_id, user_id in Player.objects.filter(user__username__in=usernames)
+                                                                                                              .values_list('user__username', 'pk', 'user_id'))
+
+        missing = [username for username in OrderedDict.fromkeys(usernames) if username not in players]
+
+        if missing:
+            raise exceptions.NotFound(detail="Players not found: %s." % ", ".join(missing))
+
+        roster = set(Game.players.through.objects.filter(game=game, player__in=[player_id for player_id, user_id in players.values()])
+                                                 .values_list('player_id', flat=True))
+
+        with transaction.atomic():
+            if add:
+                new_players = [(player_id, user_id) for player_id, user_id in players.values() if player_id not in roster]
+
+                if not new_players:
+                    return
+
+                game.players.add(*[player_id for player_id, user_id in new_players])
+
+                request_datetime = timezone.now()
+
+                Notification.objects.bulk_create([Notification(notification_type=NotificationType.ADDED_TO_GAME.value,
+                                                               creation_datetime=request_datetime,
+                                                               sender_id=game.admin_id,
+                                                               game=game,
+                                                               user_id=user_id) for player_id, user_id in new_players if user_id != game.admin_id])
+            else:
+                removed_players = [player_id for player_id, user_id in players.values() if player_id in roster]
+
+                if removed_players:
+                    game.players.remove(*removed_players)
+
+class NotificationList(StreamingListMixin, FastListMixin, EagerLoadingViewMixin, generics.ListAPIView):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
+    fast_serializer_class = FastNotificationSerializer
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
         """
         Only show notifications of authenticated user.
+        Optionally filtered by 'since' (an id or an updated_at timestamp), 'read' and 'type'.
         """
         qs = super().get_queryset()
         
         if self.request.user and self.request.user.is_authenticated:
             user = self.request.user
+
+            qs = qs.filter(user=user)
+
+            since = self.request.query_params.get('since', None)
+
+            if since is not None:
+                # A number is a notification id and only returns newer notifications,
+                # a timestamp also returns notifications changed since then
+                if since.isdigit():
+                    qs = qs.filter(id__gt=int(since))
+                else:
+                    qs = qs.filter(updated_at__gt=parse_timestamp(since, 'since'))
+
+            read = self.request.query_params.get('read', None)
+
+            if read is not None:
+                if not read in ['true', 'false']:
+                    raise exceptions.ParseError(detail="'read' must be 'true' or 'false'.")
+
+                qs = qs.filter(read=(read == 'true'))
+
+            notification_type = self.request.query_params.get('type', None)
+
+            if notification_type is not None:
+                qs = qs.filter(notification_type=parse_notification_type(notification_type).value)
         
-            return qs.filter(user=user)
+            return qs
+
+    permission_classes = [permissions.IsAuthenticated]
 
+    def patch(self, request, *args, **kwargs):
+        """
+        Marks the authenticated user's unread notifications as read in a single UPDATE.
+        Optionally restricted to a notification 'type' and to notifications created 'before' a timestamp.
+        """
+        request_json = request.data
+
+        if not ('action' in request_json and request_json['action'] == 'mark_all_as_read'):
+            raise exceptions.ParseError()
+
+        notifications = Notification.objects.filter(user=request.user)
+
+        if 'type' in request_json:
+            notification_type = parse_notification_type(request_json['type'])
+
+            notifications = notifications.filter(notification_type=notification_type.value)
+
+        if 'before' in request_json:
+            before = parse_timestamp(request_json['before'], 'before')
+
+            notifications = notifications.filter(creation_datetime__lt=before)
+
+        count = notifications.mark_as_read()
+
+        return Response({'count': count})
+
+class NotificationUnreadCount(generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the authenticated user's unread notification counter without loading any notifications.
+        """
+        return Response({'unread_count': get_unread_count(request.user)})
+
+class NotificationPoll(EagerLoadingViewMixin, generics.GenericAPIView):
+    queryset = Notification.objects.all()
+    serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    max_results = 100
+
+    def get(self, request, *args, **kwargs):
+        """
+        Long-poll for the authenticated user's notifications created, changed or deleted after the 'since' cursor.
+        Answers as soon as there are changes, or with no results once 'timeout' seconds pass.
+        Without 'since', answers right away with a cursor to start polling from.
+        Changed notifications are in 'results' and the ids of deleted ones in 'deleted'. Polling again right away with
+        the returned cursor picks up where a response capped at max_results stopped.
+        """
+        user = request.user
+
+        if not 'since' in request.query_params:
+            return self.poll_response([], (timezone.now(), None))
+
+        since = parse_poll_cursor(request.query_params['since'])
+
+        try:
+            timeout = float(request.query_params.get('timeout', 25))
+        except ValueError:
+            raise exceptions.ParseError(detail="'timeout' must be a number of seconds.")
+
+        timeout = max(0, min(timeout, getattr(settings, 'NOTIFICATION_POLL_TIMEOUT', 30)))
+
+        broker = get_broker()
+
+        # Read the broker version before querying so a change committed in between still wakes us up
+        version = broker.version(user.pk)
+        changes = self.get_changes(since)
+
+        if not changes and timeout and broker.wait(user.pk, version, timeout):
+            changes = self.get_changes(since)
+
+        return self.poll_response(changes, changes[-1][:2] if changes else since)
+
+    def get_changes(self, since):
+        """
+        Up to max_results (timestamp, notification id, notification) changes after the since cursor, in (timestamp, id) order.
+        The notification is None for deletions.
+        """
+        timestamp, last_id = since
+
+        def after(timestamp_field, id_field):
+            after = Q(**{timestamp_field + '__gt': timestamp})
+
+            # Rows sharing the cursor's timestamp, e.g. from one bulk mark_as_read(), continue after its id
+            if last_id is not None:
+                after |= Q(**{timestamp_field: timestamp, id_field + '__gt': last_id})
+
+            return after
+
+        notifications = self.get_queryset().filter(after('updated_at', 'id'), user=self.request.user).order_by('updated_at', 'id')
+        deletions = NotificationDeletion.objects.filter(after('deleted_at', 'notification_id'), user=self.request.user) \
+                                                .order_by('deleted_at', 'notification_id') \
+                                                .values_list('deleted_at', 'notification_id')
+
+        changes = [(notification.updated_at, notification.pk, notification) for notification in notifications[:self.max_results]]
+        changes += [(deleted_at, notification_id, None) for deleted_at, notification_id in deletions[:self.max_results]]
+
+        changes.sort(key=lambda change: change[:2])
+
+        return changes[:self.max_results]
+
+    def poll_response(self, changes, cursor):
+        timestamp, last_id = cursor
+
+        serializer = self.get_serializer([notification for timestamp, notification_id, notification in changes if notification is not None], many=True)
+
+        return Response({'cursor': timestamp.isoformat() if last_id is None else '%s,%i' % (timestamp.isoformat(), last_id),
+                         'unread_count': get_unread_count(self.request.user),
+                         'results': serializer.data,
+                         'deleted': [notification_id for timestamp, notification_id, notification in changes if notification is None]})
+
 class NotificationDetailPermission(permissions.BasePermission):
     
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
-class NotificationDetail(generics.RetrieveUpdateDestroyAPIView):
+class NotificationDetail(EagerLoadingViewMixin, generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'id'
 
     queryset = Notification.objects.all()
@@ -252,9 +894,9 @@ class NotificationDetail(generics.RetrieveUpdateDestroyAPIView):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     def perform_update(self, serializer):
-        notification = Notification.objects.get(id=self.kwargs['id'])
+        notification = serializer.instance
 
-        if not self.request.user == notification.user:
+        if not self.request.user.pk == notification.user_id:
             raise exceptions.PermissionDenied()
 
         if 'action' in self.request.data and self.request.data['action'] == 'mark_as_read':
@@ -274,9 +916,11 @@ class Conflict(exceptions.APIException):
     default_detail = 'Conflict'
     default_code = 'conflict'
 
-class FriendshipList(generics.ListCreateAPIView):
+class FriendshipList(StreamingListMixin, FastListMixin, EagerLoadingViewMixin, generics.ListCreateAPIView):
     queryset = Friendship.objects.all()
     serializer_class = FriendshipSerializer
+    fast_serializer_class = FastFriendshipSerializer
+    pagination_class = FriendshipPagination
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -328,34 +972,179 @@ class FriendshipList(generics.ListCreateAPIView):
         if active_request:
             raise Conflict(detail="An active friend request already exists between those users.")
 
-        already_friends = requested_player in list(requester_player.friends.all())
+        already_friends = requester_player.is_friend_with(requested_player)
 
         if already_friends:
             raise Conflict(detail="Players are already friends with eachother.")
 
         request_datetime = timezone.now()
+
+        friendship = serializer.save(request_from=requester_player,
+                                     request_to=requested_player,
+                                     request_datetime=request_datetime)
     
         notification = Notification(notification_type=NotificationType.FRIEND_REQ.value,
                                     creation_datetime=request_datetime,
                                     sender=requester_player.user,
-                                    user=requested_player.user)
+                                    user=requested_player.user,
+                                    friendship=friendship)
                 
         notification.save()
-
-        serializer.save(request_from=requester_player,
-                        request_to=requested_player,
-                        request_datetime=request_datetime)
                         
+class FriendshipBatch(generics.GenericAPIView):
+    """
+    Sends, accepts or declines many friend requests in one transaction.
+    'send' takes 'usernames', 'accept' and 'decline' take friend request 'ids'.
+    Every item gets its own result, items that can't be processed don't stop the others.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    max_items = 500
+
+    def post(self, request, *args, **kwargs):
+        action = request.data.get('action', None)
+
+        if action == 'send':
+            items = self.get_items('usernames')
+        elif action in ('accept', 'decline'):
+            items = self.get_items('ids')
+        else:
+            raise exceptions.ParseError(detail="'action' must be one of 'send', 'accept' or 'decline'.")
+
+        requester_player = Player.objects.select_related('user').get(user=request.user)
+
+        with transaction.atomic():
+            if action == 'send':
+                results = self.send(requester_player, items)
+            else:
+                results = self.respond(requester_player, items, accept=(action == 'accept'))
+
+        return Response({'results': results})
+
+    def get_items(self, key):
+        items = self.request.data.get(key, None)
+
+        if not isinstance(items, list) or len(items) > self.max_items:
+            raise exceptions.ParseError(detail="'%s' must be a list of at most %i items." % (key, self.max_items))
+
+        # bool is an int subclass, true/false aren't ids
+        if key == 'ids' and not all(isinstance(item, int) and not isinstance(item, bool) for item in items):
+            raise exceptions.ParseError(detail="'ids' must be a list of integers.")
+
+        # Duplicates are processed once
+        return list(OrderedDict.fromkeys(str(item) if key == 'usernames' else item for item in items))
+
+    def send(self, requester_player, usernames):
+        request_datetime = timezone.now()
+
+        players = {username: (player_id, user_id) for player_id, user_id, username in Player.objects.filter(user__username__in=usernames)
+                                                                                                  .values_list('pk', 'user_id', 'user__username')}
+        player_ids = [player_id for player_id, user_id in players.values()]
+
+        # Set based duplicate detection: every pending request in either direction and every friend, in two queries
+        pending = set()
+        for request_from, request_to in Friendship.objects.filter(Q(request_from=requester_player, request_to__in=player_ids) |
+                                                                  Q(request_from__in=player_ids, request_to=requester_player),
+                                                                  state__isnull=True) \
+                                                          .order_by() \
+                                                          .values_list('request_from', 'request_to'):
+            pending.add(request_to if request_from == requester_player.pk else request_from)
+
+        friends = set(requester_player.friends.filter(pk__in=player_ids).values_list('pk', flat=True))
+
+        results = OrderedDict()
+        to_request = []
+
+        for username in usernames:
+            if username not in players:
+                results[username] = {'username': username, 'status': status.HTTP_404_NOT_FOUND, 'detail': "Player %s not found." % username}
+                continue
+
+            player_id, user_id = players[username]
+
+            if player_id == requester_player.pk:
+                results[username] = {'username': username, 'status': status.HTTP_403_FORBIDDEN, 'detail': "A player cannot add himself as a friend."}
+            elif player_id in pending:
+                results[username] = {'username': username, 'status': status.HTTP_409_CONFLICT, 'detail': "An active friend request already exists between those users."}
+            elif player_id in friends:
+                results[username] = {'username': username, 'status': status.HTTP_409_CONFLICT, 'detail': "Players are already friends with eachother."}
+            else:
+                to_request.append(username)
+
+        Friendship.objects.bulk_create([Friendship(request_from=requester_player,
+                                                   request_to_id=players[username][0],
+                                                   request_datetime=request_datetime) for username in to_request])
+
+        # bulk_create doesn't set primary keys on every backend (MySQL), read the new requests back
+        created = dict(Friendship.objects.filter(request_from=requester_player,
+                                                 request_to__in=[players[username][0] for username in to_request],
+                                                 request_datetime=request_datetime,
+                                                 state__isnull=True)
+                                         .order_by()
+                                         .values_list('request_to', 'pk'))
+
+        Notification.objects.bulk_create([Notification(notification_type=NotificationType.FRIEND_REQ.value,
+                                                       creation_datetime=request_datetime,
+                                                       sender=requester_player.user,
+                                                       user_id=players[username][1],
+                                                       friendship_id=created[players[username][0]]) for username in to_request])
+
+        for username in to_request:
+            results[username] = {'username': username, 'status': status.HTTP_201_CREATED, 'id': created[players[username][0]]}
+
+        return [results[username] for username in usernames]
+
+    def respond(self, requester_player, ids, accept):
+        request_datetime = timezone.now()
+
+        friend_requests = {friendship_id: (request_from, request_to, state, user_id)
+                           for friendship_id, request_from, request_to, state, user_id in Friendship.objects.select_for_update()
+                                                                                                            .filter(pk__in=ids)
+                                                                                                            .values_list('pk', 'request_from', 'request_to', 'state', 'request_from__user')}
+
+        results = OrderedDict()
+        to_respond = []
+
+        for friendship_id in ids:
+            if friendship_id not in friend_requests:
+                results[friendship_id] = {'id': friendship_id, 'status': status.HTTP_404_NOT_FOUND, 'detail': "Friend request not found."}
+                continue
+
+            request_from, request_to, state, user_id = friend_requests[friendship_id]
+
+            if request_to != requester_player.pk or state:
+                results[friendship_id] = {'id': friendship_id, 'status': status.HTTP_403_FORBIDDEN, 'detail': "You can't answer this friend request."}
+            else:
+                to_respond.append(friendship_id)
+                results[friendship_id] = {'id': friendship_id, 'status': status.HTTP_200_OK}
+
+        if to_respond:
+            if accept:
+                # Add to player's friends list and send notifications to the new friends
+                requester_player.friends.add(*[friend_requests[friendship_id][0] for friendship_id in to_respond])
+
+                Notification.objects.bulk_create([Notification(notification_type=NotificationType.ADDED_AS_FRIEND.value,
+                                                               creation_datetime=request_datetime,
+                                                               sender=requester_player.user,
+                                                               user_id=friend_requests[friendship_id][3],
+                                                               friendship_id=friendship_id) for friendship_id in to_respond])
+
+            # Mark friend request notifications as read if they still are unread
+            Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
+                                        friendship__in=to_respond).mark_as_read(request_datetime)
+
+            Friendship.objects.filter(pk__in=to_respond).update(state="ACTIVE" if accept else "DECLINED",
+                                                                action_taken_datetime=request_datetime)
+
+        return [results[friendship_id] for friendship_id in ids]
+
 class FriendshipDetailPermission(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
 
-        requester_user = User.objects.get(username=obj.request_from.user.username)
-        requested_user = User.objects.get(username=obj.request_to.user.username)
+        return request.user.pk in (obj.request_from.user_id, obj.request_to.user_id)
 
-        return (request.user == requested_user) | (request.user == requester_user)
-
-class FriendshipDetail(generics.RetrieveUpdateDestroyAPIView):
+class FriendshipDetail(EagerLoadingViewMixin, generics.RetrieveUpdateDestroyAPIView):
     lookup_field = 'id'
 
     queryset = Friendship.objects.all()
@@ -368,64 +1157,48 @@ class FriendshipDetail(generics.RetrieveUpdateDestroyAPIView):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     def perform_update(self, serializer):
-        friend_request = Friendship.objects.get(id=self.kwargs['id'])
+        # Loaded by get_object() with both players, compare user ids so no user is fetched
+        friend_request = serializer.instance
+        is_requester = self.request.user.pk == friend_request.request_from.user_id
+        is_requested = self.request.user.pk == friend_request.request_to.user_id
 
-        if not ((self.request.user == friend_request.request_from.user or self.request.user == friend_request.request_to.user) and not friend_request.state):
+        if not ((is_requester or is_requested) and not friend_request.state):
             raise exceptions.PermissionDenied()
         
-        if self.request.user == friend_request.request_from.user and 'action' in self.request.data and self.request.data['action'] == 'cancel':
-            notification = Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
-                                                        creation_datetime=friend_request.request_datetime,
-                                                        user=friend_request.request_to.user,
-                                                        read=False)
-            if notification:
-                notification.delete()
+        if is_requester and 'action' in self.request.data and self.request.data['action'] == 'cancel':
+            Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
+                                        friendship=friend_request,
+                                        read=False).delete()
             serializer.save(state="CANCELED",
                             action_taken_datetime=timezone.now())
         
-        elif self.request.user == friend_request.request_to.user and 'action' in self.request.data and self.request.data['action'] == 'accept':
+        elif is_requested and 'action' in self.request.data and self.request.data['action'] == 'accept':
             request_datetime = timezone.now()
 
             # Add to player's friends list and send notification to new friend
-            player = Player.objects.get(user=self.request.user)
-            player.friends.add(friend_request.request_from)
+            friend_request.request_to.friends.add(friend_request.request_from)
 
             notification = Notification(notification_type=NotificationType.ADDED_AS_FRIEND.value,
                                         creation_datetime=request_datetime,
-                                        sender=player.user,
-                                        user=friend_request.request_from.user)
+                                        sender_id=self.request.user.pk,
+                                        user_id=friend_request.request_from.user_id,
+                                        friendship=friend_request)
             notification.save()
 
             # Mark friend request notification as read if it still is unread
-            friend_request_notification = Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
-                                                        creation_datetime=friend_request.request_datetime,
-                                                        user=friend_request.request_to.user,
-                                                        read=False)
-            
-            if friend_request_notification:
-                friend_request_notification = Notification.objects.get(pk=friend_request_notification[0].pk)
-                friend_request_notification.read = True
-                friend_request_notification.read_datetime = request_datetime
-                friend_request_notification.save()
+            Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
+                                        friendship=friend_request).mark_as_read(request_datetime)
             
             # Update friend_request state and save datetime of action_taken
             serializer.save(state="ACTIVE",
                             action_taken_datetime=request_datetime)
 
-        elif self.request.user == friend_request.request_to.user and 'action' in self.request.data and self.request.data['action'] == 'decline':
+        elif is_requested and 'action' in self.request.data and self.request.data['action'] == 'decline':
             request_datetime = timezone.now()
 
             # Mark friend request notification as read if it still is unread
-            friend_request_notification = Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
-                                                        creation_datetime=friend_request.request_datetime,
-                                                        user=friend_request.request_to.user,
-                                                        read=False)
-            
-            if friend_request_notification:
-                friend_request_notification = Notification.objects.get(pk=friend_request_notification[0].pk)
-                friend_request_notification.read = True
-                friend_request_notification.read_datetime = request_datetime
-                friend_request_notification.save()
+            Notification.objects.filter(notification_type=NotificationType.FRIEND_REQ.value,
+                                        friendship=friend_request).mark_as_read(request_datetime)
 
             # Update friend_request state and save datetime of action_taken
             serializer.save(state="DECLINED",
@@ -440,35 +1213,29 @@ class FriendshipDetail(generics.RetrieveUpdateDestroyAPIView):
     def perform_destroy(self, instance):
 
         # Remove player from friends in the Player model
-        user = self.request.user
-        requester_player = Player.objects.get(user=user)
-
-        friend_request = Friendship.objects.get(id=self.kwargs['id'])
-        
-        if not friend_request.state == "ACTIVE":
+        if not instance.state == "ACTIVE":
             raise exceptions.PermissionDenied()
 
-        if friend_request.request_from == requester_player:
-            player_to_remove = friend_request.request_to
+        if instance.request_from.user_id == self.request.user.pk:
+            requester_player, player_to_remove = instance.request_from, instance.request_to
         else:
-            player_to_remove = friend_request.request_from
+            requester_player, player_to_remove = instance.request_to, instance.request_from
 
         requester_player.friends.remove(player_to_remove)
 
         # Remove "X accepted your friend request." notification from the requester if it hasn't been read yet
-        notification = Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value,
-                                                user=player_to_remove.user,
-                                                read=False)
-        
-        if notification:
-            notification.delete()
+        Notification.objects.filter(notification_type=NotificationType.ADDED_AS_FRIEND.value,
+                                    friendship=instance,
+                                    read=False).delete()
 
         # Delete active Friendship instance
         instance.delete()
 
-class GameParticipationRequestList(generics.ListCreateAPIView):
+class GameParticipationRequestList(StreamingListMixin, FastListMixin, EagerLoadingViewMixin, generics.ListCreateAPIView):
     queryset = GameParticipationRequest.objects.all()
     serializer_class = GameParticipationRequestSerializer
+    fast_serializer_class = FastGameParticipationRequestSerializer
+    pagination_class = GameParticipationRequestPagination
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -503,31 +1270,32 @@ class GameParticipationRequestList(generics.ListCreateAPIView):
         if active_request:
             raise Conflict(detail="An active request already exists from this user.")
 
-        participating = player in game.players.all()
+        participating = game.has_player(player)
     
         if participating:
             raise Conflict(detail="Already participating.")
 
         request_datetime = timezone.now()
+
+        participation_request = serializer.save(request_from=player,
+                                                request_to_game=game,
+                                                request_datetime=request_datetime)
     
         notification = Notification(notification_type=NotificationType.PARTICIPATION_REQ.value,
                                     creation_datetime=request_datetime,
                                     sender=user,
                                     game=game,
-                                    user=game.admin)
+                                    user=game.admin,
+                                    participation_request=participation_request)
                 
         notification.save()
 
-        serializer.save(request_from=player,
-                        request_to_game=game,
-                        request_datetime=request_datetime)
-
 class GamePaticipationRequestDetailPermission(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        return ((request.user == obj.request_from.user or request.user == obj.request_to_game.admin) and not obj.state)
+        return request.user.pk in (obj.request_from.user_id, obj.request_to_game.admin_id) and not obj.state
 
-class GameParticipationRequestDetail(generics.RetrieveUpdateAPIView):
+class GameParticipationRequestDetail(EagerLoadingViewMixin, generics.RetrieveUpdateAPIView):
     lookup_field = 'id'
 
     queryset = GameParticipationRequest.objects.all()
@@ -540,25 +1308,25 @@ class GameParticipationRequestDetail(generics.RetrieveUpdateAPIView):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
     def perform_update(self, serializer):
-        participation_request = GameParticipationRequest.objects.get(id=self.kwargs['id'])
+        # Loaded by get_object() with the requester and the game, compare user ids so no user is fetched
+        participation_request = serializer.instance
+        is_requester = self.request.user.pk == participation_request.request_from.user_id
+        is_admin = self.request.user.pk == participation_request.request_to_game.admin_id
 
-        if not ((self.request.user == participation_request.request_from.user or self.request.user == participation_request.request_to_game.admin) and not participation_request.state):
+        if not ((is_requester or is_admin) and not participation_request.state):
             raise exceptions.PermissionDenied()
 
-        if self.request.user == participation_request.request_from.user and 'action' in self.request.data and self.request.data['action'] == 'cancel':
+        if is_requester and 'action' in self.request.data and self.request.data['action'] == 'cancel':
 
             # Remove notification from game admin if it still is unread
-            notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                    creation_datetime=participation_request.request_datetime,
-                                                    user=participation_request.request_to_game.admin,
-                                                    read=False)
-            if notification:
-                notification.delete()
+            Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                        participation_request=participation_request,
+                                        read=False).delete()
 
             serializer.save(state="CANCELED",
                             action_taken_datetime=timezone.now())
         
-        elif self.request.user == participation_request.request_to_game.admin and 'action' in self.request.data and self.request.data['action'] == 'accept':
+        elif is_admin and 'action' in self.request.data and self.request.data['action'] == 'accept':
 
             request_datetime = timezone.now()
 
@@ -567,42 +1335,27 @@ class GameParticipationRequestDetail(generics.RetrieveUpdateAPIView):
 
             notification = Notification(notification_type=NotificationType.ADDED_TO_GAME.value,
                                         creation_datetime=request_datetime,
-                                        sender=participation_request.request_to_game.admin,
+                                        sender_id=participation_request.request_to_game.admin_id,
                                         game=participation_request.request_to_game,
-                                        user=participation_request.request_from.user)
+                                        user_id=participation_request.request_from.user_id,
+                                        participation_request=participation_request)
             notification.save()
 
             # Mark game participation request notification as read if it still is unread
-            participation_request_notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                                            creation_datetime=participation_request.request_datetime,
-                                                                            user=participation_request.request_to_game.admin,
-                                                                            read=False)
-            
-            if participation_request_notification:
-                participation_request_notification = Notification.objects.get(pk=participation_request_notification[0].pk)
-                participation_request_notification.read = True
-                participation_request_notification.read_datetime = request_datetime
-                participation_request_notification.save()
+            Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                        participation_request=participation_request).mark_as_read(request_datetime)
 
             # Update participation_request state and save datetime of action_taken
             serializer.save(state="ACCEPTED",
                             action_taken_datetime=request_datetime)
             
-        elif self.request.user == participation_request.request_to_game.admin and 'action' in self.request.data and self.request.data['action'] == 'decline':
+        elif is_admin and 'action' in self.request.data and self.request.data['action'] == 'decline':
 
             request_datetime = timezone.now()
 
             # Mark game participation request notification as read if it still is unread
-            notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                    creation_datetime=participation_request.request_datetime,
-                                                    user=participation_request.request_to_game.admin,
-                                                    read=False)
-                                                    
-            if notification:
-                notification = Notification.objects.get(pk=notification[0].pk)
-                notification.read = True
-                notification.read_datetime = request_datetime
-                notification.save()
+            Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                        participation_request=participation_request).mark_as_read(request_datetime)
 
             # Update participation_request state and save datetime of action_taken
             serializer.save(state="DECLINED",
@@ -610,3 +1363,17 @@ class GameParticipationRequestDetail(generics.RetrieveUpdateAPIView):
 
         else:
             raise exceptions.ParseError()
+
+class QueryStats(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Per-view query counts, database time and repeated queries recorded by QueryBudgetMiddleware in this process.
+        """
+        return Response(get_query_stats().snapshot())
+
+    def delete(self, request, *args, **kwargs):
+        get_query_stats().reset()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
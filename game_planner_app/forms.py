@@ -2,7 +2,8 @@ import datetime
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from game_planner_api.models import Player, Game, pkgen
+from django.db import IntegrityError
+from game_planner_api.models import Player, Game
 
 class SignUpForm(forms.Form):
     username = forms.CharField(label='Username', max_length=30)
@@ -59,7 +60,29 @@ class LoginForm(forms.Form):
         if authenticate(username=username, password=password) == None:
             self.add_error('password', "Invalid password.")            
 
+class PlayerPickerWidget(forms.SelectMultiple):
+    """
+    Renders only the selected players as options, loaded with one query.
+    Other players are added as options by script.js from the player search API as the user types.
+    """
+    def __init__(self, attrs=None):
+        attrs = dict(attrs or {}, **{'class': 'player-picker', 'data-search-url': '/api/players/search'})
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        player_ids = [player_id for player_id in value if str(player_id).isdigit()]
+
+        players = Player.objects.filter(pk__in=player_ids).order_by('user__username').values_list('pk', 'user__username') if player_ids else []
+
+        return [(None, [self.create_option(name, player_id, username, True, index, attrs=attrs)], index)
+                for index, (player_id, username) in enumerate(players)]
+
 class PlayerModelMultipleChoiceField(forms.ModelMultipleChoiceField):
+    """
+    Submitted ids are validated with a single IN query, the whole queryset is never enumerated.
+    """
+    widget = PlayerPickerWidget
+
     def label_from_instance(self, obj):
         return obj.user.username
 
@@ -80,39 +103,31 @@ class CreateGameForm(forms.Form):
 
     def clean(self):
         # Confirm that new game name doesn't already exist for logged in user
-        #  Get player
-        player = Player.objects.get(user_id=self.user.id)
-        #  Get player's games list
-        user_games = Game.objects.filter(admin=self.user)
-        #  Iterate over games to check that none have the same name
-        for game in user_games:
-            if game.name == self.cleaned_data['name']:
-                self.add_error('name', "You already have a game with this name. Please choose a different one.")
-                break
+        if 'name' in self.cleaned_data and Game.objects.name_taken(self.user, self.cleaned_data['name']):
+            self.add_error('name', Game.DUPLICATE_NAME_MESSAGE)
 
     def save(self):
-        player = Player.objects.get(user_id=self.user.id)
-
-        success = False
-
-        # Generate a new pk not already in use
-        while not success:
-            self.pk = pkgen()
-            success = not Game.objects.filter(game_id=self.pk).exists()
-
-        game = Game(game_id=self.pk,
-                    name=self.cleaned_data['name'],
-                    admin=self.user,
-                    when=self.cleaned_data['when'],
-                    where=self.cleaned_data['where'],
-                    #players=self.cleaned_data['players'],
-                    price=self.cleaned_data['price'],
-                    duration=self.cleaned_data['duration'],
-                    private=self.cleaned_data['private'])
-                    
-        game.save()
-        game.players.set(self.cleaned_data['players'])
-        
+        # The id is generated by the insert itself, without checking for a free one first,
+        # and the players are added in the same transaction
+        try:
+            game = Game.objects.create_with_generated_id(name=self.cleaned_data['name'],
+                                                         admin=self.user,
+                                                         when=self.cleaned_data['when'],
+                                                         where=self.cleaned_data['where'],
+                                                         price=self.cleaned_data['price'],
+                                                         duration=self.cleaned_data['duration'],
+                                                         private=self.cleaned_data['private'],
+                                                         players=self.cleaned_data['players'])
+        except IntegrityError:
+            # Same name created concurrently since clean()
+            if not Game.objects.name_taken(self.user, self.cleaned_data['name']):
+                raise
+
+            self.add_error('name', Game.DUPLICATE_NAME_MESSAGE)
+            return False
+
+        self.pk = game.game_id
+
         return True
 
 class ManageProfileForm(forms.Form):
@@ -194,34 +209,28 @@ class ManageGameForm(forms.Form):
         super(ManageGameForm, self).__init__(*args, **kwargs)
 
     def clean(self):
-        game = self.game
-        name = self.cleaned_data['name']
-        when = self.cleaned_data['when']
-        where = self.cleaned_data['where']
-        players = self.cleaned_data['players']
-        price = self.cleaned_data['price']
-        duration = self.cleaned_data['duration']
-        private = self.cleaned_data['private']
-
-        if name:
-            game.name = name
-        
-        if when:
-            game.when = when
-        
-        if where:
-            game.where = where
+        name = self.cleaned_data.get('name')
 
-        if players:
-            game.players.set(players)
-        
-        if price:
-            game.price = price
-        
-        if duration:
-            game.duration = duration
+        if name and name != self.game.name and Game.objects.name_taken(self.game.admin_id, name):
+            self.add_error('name', Game.DUPLICATE_NAME_MESSAGE)
+
+    def save(self):
+        # Only fields that were filled in are changed
+        fields = {field: self.cleaned_data[field] for field in ['name', 'when', 'where', 'price', 'duration'] if self.cleaned_data[field]}
 
         #TODO find new way to change privacy setting    
-        game.private = private
-        
-        game.save()
+        fields['private'] = self.cleaned_data['private']
+
+        new_name = fields['name'] if fields.get('name', self.game.name) != self.game.name else None
+
+        try:
+            self.game.update(players=self.cleaned_data['players'] or None, **fields)
+        except IntegrityError:
+            # Same name taken concurrently since clean(), keeping the current name can't be the cause
+            if new_name is None or not Game.objects.name_taken(self.game.admin_id, new_name):
+                raise
+
+            self.add_error('name', Game.DUPLICATE_NAME_MESSAGE)
+            return False
+
+        return True
@@ -6,6 +6,7 @@ function mark_as_read(notification_id) {
         if (this.readyState == 4 && this.status == 200) {
             // Using the element id, change item color and remove mark as read button from the notification in the dropdown
 
+            get_unread_count();
         }
     };
 
@@ -30,6 +31,7 @@ function mark_all_as_read() {
     xhttp.onreadystatechange = function() {
         if (this.readyState == 4 && this.status == 200) {
             console.log("all notifications marked as read!");
+            get_unread_count();
         }
     }
 
@@ -42,13 +44,154 @@ function mark_all_as_read() {
     xhttp.send();
 }
 
+function get_unread_count() {
+
+    var badge = document.getElementById("notificationsBadge");
+
+    // Badge is only rendered for authenticated users
+    if(!badge) {
+        return;
+    }
+
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if (this.readyState == 4 && this.status == 200) {
+            set_unread_count(JSON.parse(xhttp.responseText).unread_count);
+        }
+    };
+
+    xhttp.open("GET", "/api/notifications/unread_count", true);
+    xhttp.send();
+}
+
+function set_unread_count(unread_count) {
+    var badge = document.getElementById("notificationsBadge");
+
+    badge.textContent = unread_count;
+    badge.hidden = (unread_count === 0);
+}
+
+// Notifications shown in the dropdown, by id. Loaded once, then kept up to date by poll_notifications()
+var notifications_by_id = null;
+
+function merge_notifications(notifications) {
+    for(var i = 0; i < notifications.length; i++) {
+        notifications_by_id[notifications[i].id] = notifications[i];
+    }
+}
+
+function poll_notifications(cursor) {
+
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if (this.readyState != 4) {
+            return;
+        }
+
+        if (this.status == 200) {
+            var response = JSON.parse(xhttp.responseText);
+
+            set_unread_count(response.unread_count);
+
+            if(notifications_by_id !== null && (response.results.length > 0 || response.deleted.length > 0)) {
+                merge_notifications(response.results);
+
+                for(var i = 0; i < response.deleted.length; i++) {
+                    delete notifications_by_id[response.deleted[i]];
+                }
+
+                make_notification_list();
+            }
+
+            poll_notifications(response.cursor);
+        } else {
+            // Back off before polling again if the server is unavailable
+            setTimeout(function(){ poll_notifications(cursor); }, 10000);
+        }
+    };
+
+    var url = "/api/notifications/poll";
+
+    if(cursor) {
+        url += "?since=" + encodeURIComponent(cursor);
+    }
+
+    xhttp.open("GET", url, true);
+    xhttp.send();
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+    // Badge is only rendered for authenticated users
+    if(document.getElementById("notificationsBadge")) {
+        poll_notifications(null);
+    }
+});
+
+function search_players(select, query) {
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if (this.readyState == 4 && this.status == 200) {
+            var players = JSON.parse(xhttp.responseText);
+
+            // Keep selected players, replace the previous search results
+            for(var i = select.options.length - 1; i >= 0; i--) {
+                if(!select.options[i].selected) {
+                    select.remove(i);
+                }
+            }
+
+            players.forEach(function(player) {
+                if(!select.querySelector("option[value='" + player.id + "']")) {
+                    select.appendChild(new Option(player.username, player.id));
+                }
+            });
+        }
+    };
+
+    xhttp.open("GET", select.dataset.searchUrl + "?q=" + encodeURIComponent(query), true);
+    xhttp.send();
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+    // Player pickers only render selected players, others are found by username
+    document.querySelectorAll("select.player-picker").forEach(function(select) {
+        var search = document.createElement("input");
+        var timeout = null;
+
+        search.type = "search";
+        search.placeholder = "Search players";
+
+        search.addEventListener("input", function() {
+            clearTimeout(timeout);
+
+            if(search.value) {
+                timeout = setTimeout(function(){ search_players(select, search.value); }, 250);
+            }
+        });
+
+        select.parentNode.insertBefore(search, select);
+        select.parentNode.insertBefore(document.createElement("br"), select);
+    });
+});
+
 function get_notifications() {
 
+    // Changes after the first load arrive through poll_notifications()
+    if(notifications_by_id !== null) {
+        make_notification_list();
+        return;
+    }
+
     var xhttp = new XMLHttpRequest();
 
     xhttp.onreadystatechange = function() {
         if (this.readyState == 4 && this.status == 200) {
-            make_notification_list(xhttp.responseText); 
+            notifications_by_id = {};
+            merge_notifications(JSON.parse(xhttp.responseText).results);
+            make_notification_list();
         }
     };
 
@@ -56,8 +199,11 @@ function get_notifications() {
     xhttp.send();
 }
 
-function make_notification_list(notification_json) {
-    var notifications = JSON.parse(notification_json);
+function make_notification_list() {
+    var notifications = Object.keys(notifications_by_id).map(function(id) { return notifications_by_id[id]; });
+
+    // Newest first
+    notifications.sort(function(a, b) { return new Date(b.creation_datetime) - new Date(a.creation_datetime); });
 
     var notification_list = document.createElement('ul');
     notification_list.className = "list-group";
@@ -70,7 +216,7 @@ function make_notification_list(notification_json) {
         notification_list.appendChild(text_paragraph);
     }
 
-    for(var i = notifications.length - 1; i >= 0; i--) {
+    for(var i = 0; i < notifications.length; i++) {
         var notif_li = document.createElement('li');
         var text_paragraph = document.createElement('p');
 
@@ -174,10 +320,9 @@ function make_notification_list(notification_json) {
 
     dropdown_content = document.getElementById("notificationsDropdownContent");
 
-    setTimeout(function(){ 
-        document.getElementById("notificationDropdownLoadingSpinner").outerHTML = "";
-        dropdown_content.appendChild(notification_list);
-    }, 1000);
+    // Replaces the loading spinner or the previously rendered list
+    dropdown_content.innerHTML = "";
+    dropdown_content.appendChild(notification_list);
 }
 
 function send_request(method, url, args) {
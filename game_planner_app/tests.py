@@ -1,9 +1,111 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import IntegrityError
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from game_planner_api.models import Player, Game
+from .forms import CreateGameForm, ManageGameForm
 
 class ManageProfileFormTests(TestCase):
 
     def test_every_field_empty(self):
         """
         
-        """
\ No newline at end of file
+        """
+
+class PlayerPickerTests(TestCase):
+
+    def setUp(self):
+        self.players = [Player.objects.create(user=User.objects.create(username='player%i' % i)) for i in range(10)]
+
+    def test_renders_only_selected_players(self):
+        with self.assertNumQueries(0):
+            self.assertNotIn('<option', str(CreateGameForm()['players']))
+
+        form = CreateGameForm({'players': [self.players[3].pk, self.players[5].pk]})
+
+        with self.assertNumQueries(1):
+            rendered = str(form['players'])
+
+        self.assertEqual(rendered.count('<option'), 2)
+        self.assertIn('>player3</option>', rendered)
+
+    def test_validates_ids_with_one_query(self):
+        field = CreateGameForm().fields['players']
+
+        with self.assertNumQueries(1):
+            players = field.clean([str(player.pk) for player in self.players[:3]])
+
+        self.assertEqual(sorted(player.pk for player in players), [player.pk for player in self.players[:3]])
+
+class GameNameTests(TestCase):
+
+    def setUp(self):
+        self.admin = Player.objects.create(user=User.objects.create(username='admin'))
+
+        for i in range(20):
+            Game.objects.create_with_generated_id(name='Game %i' % i,
+                                                  admin=self.admin.user,
+                                                  when=timezone.now(),
+                                                  where='Lisbon',
+                                                  price=0,
+                                                  duration=timedelta(hours=1))
+
+    def make_form(self, name):
+        return CreateGameForm({'name': name, 'when': '2030-01-01 20:00:00', 'where': 'Lisbon', 'price': 0, 'duration': '01:00:00'},
+                              user=self.admin.user)
+
+    def test_duplicate_name_is_one_indexed_query(self):
+        form = self.make_form('Game 7')
+
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+
+        self.assertEqual(form.errors['name'], [Game.DUPLICATE_NAME_MESSAGE])
+
+    def test_concurrently_created_duplicate_is_a_form_error(self):
+        form = self.make_form('New game')
+        self.assertTrue(form.is_valid())
+
+        Game.objects.create_with_generated_id(name='New game',
+                                              admin=self.admin.user,
+                                              when=timezone.now(),
+                                              where='Lisbon',
+                                              price=0,
+                                              duration=timedelta(hours=1))
+
+        self.assertFalse(form.save())
+        self.assertEqual(form.errors['name'], [Game.DUPLICATE_NAME_MESSAGE])
+
+    def test_other_admins_can_reuse_names(self):
+        other = Player.objects.create(user=User.objects.create(username='other'))
+
+        self.assertTrue(CreateGameForm(self.make_form('Game 7').data, user=other.user).is_valid())
+
+    def test_manage_form_only_writes_on_save(self):
+        game = Game.objects.get(name='Game 1')
+        form = ManageGameForm({'name': 'Renamed', 'where': 'Porto', 'players': [self.admin.pk]}, game=game)
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(Game.objects.get(pk=game.pk).name, 'Game 1')
+
+        self.assertTrue(form.save())
+
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual((game.name, game.where), ('Renamed', 'Porto'))
+        self.assertEqual(list(game.players.all()), [self.admin])
+
+        self.assertFalse(ManageGameForm({'name': 'Game 2'}, game=game).is_valid())
+
+    def test_manage_form_keeping_the_name_is_not_a_duplicate(self):
+        game = Game.objects.get(name='Game 1')
+        form = ManageGameForm({'name': 'Game 1', 'where': 'Porto'}, game=game)
+
+        self.assertTrue(form.is_valid())
+
+        with mock.patch.object(Game, 'update', side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            form.save()
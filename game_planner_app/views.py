@@ -22,10 +22,6 @@ from .forms import SignUpForm, LoginForm, CreateGameForm, ManageProfileForm, Man
 def index(request):
     params = {'user': request.user}
 
-    if request.user.is_authenticated:
-        notifications = Notification.objects.filter(user=request.user, read=False)
-        params['notifications'] = notifications
-
     return render(request, 'game_planner_app/index.html', params)
 
 def login_view(request):
@@ -90,8 +86,7 @@ def manage_profile(request):
 def create_game(request):
     if request.method == 'POST':
         form = CreateGameForm(request.POST, user=request.user)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and form.save():
             return redirect('game_planner_app:game_detail', pk=form.pk)
     else:
         form = CreateGameForm()
@@ -112,7 +107,7 @@ def manage_game(request, pk):
 
         if request.method == 'POST':
             form = ManageGameForm(request.POST, game=game)
-            if form.is_valid():
+            if form.is_valid() and form.save():
                 return redirect('game_planner_app:game_detail', pk=pk)
         else:
             form = ManageGameForm()
@@ -139,9 +134,9 @@ class GamesListView(generic.ListView):
 
         games_dictionary = {}
 
-        games_dictionary['administered'] = qs.filter(admin=user)
-        games_dictionary['invited'] = qs.filter(players=player)
-        games_dictionary['public'] = qs.filter(private=False)
+        games_dictionary['administered'] = qs.administered_by(user)
+        games_dictionary['invited'] = qs.with_player(player)
+        games_dictionary['public'] = qs.public()
 
         return games_dictionary
     
@@ -167,9 +162,9 @@ def game_detail(request, pk):
     if request.user and request.user.is_authenticated:
         player = Player.objects.get(user=request.user)
         is_admin = (request.user == game.admin)
-        authorized = (player in game.players.all()) or is_admin or not game.private
+        participating = is_admin or game.has_player(player)
 
-        participating = (player in game.players.all()) or is_admin
+        authorized = participating or not game.private
 
         active_participation_request = GameParticipationRequest.objects.filter(request_from=player, request_to_game=game, state__isnull=True)
 
@@ -201,7 +196,7 @@ class ProfileView(generic.DetailView):
             request_player = Player.objects.get(user=self.request.user)
 
             # Add are_friends flag to context
-            context['are_friends'] = player in list(request_player.friends.all())
+            context['are_friends'] = request_player.is_friend_with(player)
 
             # Check if there's an existing active outgoing request
             outgoing_request = Friendship.objects.filter(request_from=request_player, request_to=player, state__isnull=True)
@@ -211,18 +206,12 @@ class ProfileView(generic.DetailView):
             incoming_request = Friendship.objects.filter(request_from=player, request_to=request_player, state__isnull=True)
             context['incoming_request'] = incoming_request
 
-            # Add games list containing: public games, games authenticated user is also invited to, games authenticated user is admin
-            games = Game.objects.filter(players=player, private=False) \
-                                    | Game.objects.filter(players=player).filter(players=request_player) \
-                                    | Game.objects.filter(players=player, admin=self.request.user)
-            games = games.distinct()
+        # Add games list containing: public games, games authenticated user is also invited to, games authenticated user is admin
+        games = Game.objects.with_player(player).visible_to(self.request.user)
 
-        else:
-            # Add public games
-            games = Game.objects.filter(players=player, private=False)
-
-        context['past_games'] = games.filter(when__lte=timezone.now())
-        context['upcoming_games'] = games.filter(when__gt=timezone.now())
+        now = timezone.now()
+        context['past_games'] = games.filter(when__lte=now).order_by('-when')
+        context['upcoming_games'] = games.filter(when__gt=now).order_by('when')
         
         # Add profile player to context
         context['player'] = player
@@ -233,16 +222,10 @@ class ProfileView(generic.DetailView):
         return context
 
 def notification_read_common(user, notification_id):
-    notification = Notification.objects.get(pk=notification_id)
+    # Only marks the notification if it belongs to user and is still unread
+    marked = Notification.objects.filter(pk=notification_id, user=user).mark_as_read()
 
-    if notification.user == user and notification.read == False:
-        notification.read = True
-        notification.read_datetime = timezone.now()
-        notification.save()
-        
-        return True
-    else:
-        return False
+    return marked > 0
 
 @login_required
 def notification_read(request):
@@ -258,18 +241,9 @@ def notification_read(request):
 
 @login_required
 def mark_all_as_read(request):
-    unread_notifications = Notification.objects.filter(user=request.user,
-                                                    read=False)
-    
-    success = True
+    Notification.objects.filter(user=request.user).mark_as_read()
 
-    for notif in unread_notifications:
-        success = notification_read_common(request.user, notif.id)
-
-    if(success):
-        return HttpResponse("OK")
-    else:
-        return HttpResponseNotFound()
+    return HttpResponse("OK")
 
 @login_required
 def friend_requests(request):
@@ -308,7 +282,8 @@ def manage_participation(request):
                                                 creation_datetime=request_datetime,
                                                 sender=participation_request.request_to_game.admin,
                                                 game=participation_request.request_to_game,
-                                                user=participation_request.request_from.user)
+                                                user=participation_request.request_from.user,
+                                                participation_request=participation_request)
                     notification.save()
 
                     # Update participation_request state and save datetime of action_taken
@@ -317,28 +292,22 @@ def manage_participation(request):
                     participation_request.save()
 
                     # Mark game participation request notification as read if it still is unread
-                    notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                            creation_datetime=participation_request.request_datetime,
-                                                            user=participation_request.request_to_game.admin,
-                                                            read=False)
-                    if notification:
-                        notification_read_common(request.user, notification[0].pk)
+                    Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                                participation_request=participation_request).mark_as_read(request_datetime)
 
                     return HttpResponse("OK")
                 
                 elif request_json['state'] == "declined":
+                    request_datetime = timezone.now()
+
                     # Update participation_request state and save datetime of action_taken
                     participation_request.state = "DECLINED"
-                    participation_request.action_taken_datetime = timezone.now()
+                    participation_request.action_taken_datetime = request_datetime
                     participation_request.save()
 
                     # Mark game participation request notification as read if it still is unread
-                    notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                            creation_datetime=participation_request.request_datetime,
-                                                            user=participation_request.request_to_game.admin,
-                                                            read=False)
-                    if notification:
-                        notification_read_common(request.user, notification[0].pk)
+                    Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                                participation_request=participation_request).mark_as_read(request_datetime)
 
                     return HttpResponse("OK")
             
@@ -352,12 +321,9 @@ def manage_participation(request):
                     participation_request.save()
 
                     # Remove notification from game admin if it still is unread
-                    notification = Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
-                                                            creation_datetime=participation_request.request_datetime,
-                                                            user=participation_request.request_to_game.admin,
-                                                            read=False)
-                    if notification:
-                        notification.delete()
+                    Notification.objects.filter(notification_type=NotificationType.PARTICIPATION_REQ.value,
+                                                participation_request=participation_request,
+                                                read=False).delete()
 
                     return HttpResponse("OK")
                     
@@ -387,6 +353,7 @@ def manage_participation(request):
                                                 creation_datetime=request_datetime,
                                                 sender=request.user,
                                                 game=game,
-                                                user=game.admin)
+                                                user=game.admin,
+                                                participation_request=participation_request)
                     notification.save()
                     return redirect('game_planner_app:game_detail', pk=request_json['pk'])
\ No newline at end of file